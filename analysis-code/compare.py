@@ -0,0 +1,247 @@
+#!/bin/python3
+"""Compares the download times of two campaigns, cell by cell, with bootstrap confidence intervals.
+
+A cell is one combination of file size, erasure coding level, retrieval strategy
+and server. For every cell present in both campaigns this computes
+
+- the ratio of the median download time (candidate / baseline),
+- the ratio of a tail quantile (`--tail`, the 95th percentile by default),
+- the difference in failure rate (candidate - baseline),
+
+each with a percentile bootstrap confidence interval. Resamples are drawn as one
+(resamples x n) index array per cell, so thousands of resamples per cell take
+milliseconds. Times are those of successful downloads; failures only count
+towards the failure rate.
+
+A cell is flagged as a regression when its interval lies entirely on the worse
+side and the point estimate is worse by at least `--min-effect`:
+
+    python3 analysis-code/compare.py swarm-2025-07 swarm-2025-07_with_PR5097 --output compare.json
+
+The data comes from the store written by ingest.py, which is brought up to date first.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+from ingest import STORE_FILE, ingest, load_store
+
+ERASURE_NAMES = {-1: "NONE", 0: "NONE", 1: "MEDIUM", 2: "STRONG", 3: "INSANE", 4: "PARANOID"}
+STRATEGY_NAMES = {-1: "NONE", 0: "NONE", 1: "DATA", 2: "PROX", 3: "RACE"}
+
+def bootstrap(values, resamples, rng, statistic):
+    """
+    Bootstraps a statistic of one sample.
+
+    Args:
+        values (np.ndarray): The sample.
+        resamples (int): Number of resamples.
+        rng (np.random.Generator): Source of the resample indices.
+        statistic (callable): Reduces a (resamples, n) array along axis 1.
+
+    Returns:
+        np.ndarray: The statistic of every resample; all NaN for an empty sample.
+    """
+    if len(values) == 0:
+        return np.full(resamples, np.nan)
+    indices = rng.integers(0, len(values), size=(resamples, len(values)))
+    return statistic(values[indices])
+
+def interval(samples, confidence):
+    """Percentile interval of bootstrap samples, (NaN, NaN) if they are all NaN."""
+    samples = samples[~np.isnan(samples)]
+    if len(samples) == 0:
+        return np.nan, np.nan
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(samples, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+def compare_cell(baseline, candidate, resamples, confidence, tail, rng):
+    """
+    Compares one cell of two campaigns.
+
+    Args:
+        baseline (tuple): (times, ok) arrays of the baseline campaign.
+        candidate (tuple): (times, ok) arrays of the candidate campaign.
+
+    Returns:
+        dict: Sample sizes, point estimates and intervals of the median ratio,
+        tail ratio and failure rate difference.
+    """
+    median = lambda sample: np.median(sample, axis=1)
+    quantile = lambda sample: np.quantile(sample, tail, axis=1)
+    failure_rate = lambda sample: 1 - sample.mean(axis=1)
+
+    (times_a, ok_a), (times_b, ok_b) = baseline, candidate
+    success_a, success_b = times_a[ok_a], times_b[ok_b]
+
+    result = {"n_baseline": int(len(ok_a)), "n_candidate": int(len(ok_b))}
+    for name, statistic in (("median", median), ("tail", quantile)):
+        point_a = float(statistic(success_a[None, :])[0]) if len(success_a) else np.nan
+        point_b = float(statistic(success_b[None, :])[0]) if len(success_b) else np.nan
+        ratios = bootstrap(success_b, resamples, rng, statistic) / bootstrap(success_a, resamples, rng, statistic)
+        result[f"{name}_baseline"] = point_a
+        result[f"{name}_candidate"] = point_b
+        result[f"{name}_ratio"] = point_b / point_a if point_a else np.nan
+        result[f"{name}_ratio_ci"] = interval(ratios, confidence)
+
+    ok_a, ok_b = ok_a.astype(float), ok_b.astype(float)
+    result["failure_baseline"] = float(1 - ok_a.mean()) if len(ok_a) else np.nan
+    result["failure_candidate"] = float(1 - ok_b.mean()) if len(ok_b) else np.nan
+    result["failure_difference"] = result["failure_candidate"] - result["failure_baseline"]
+    differences = bootstrap(ok_b, resamples, rng, failure_rate) - bootstrap(ok_a, resamples, rng, failure_rate)
+    result["failure_difference_ci"] = interval(differences, confidence)
+    return result
+
+def verdict(result, min_effect):
+    """
+    Labels a compared cell.
+
+    Returns:
+        list: "slower", "tail-slower", "more-failures", "faster", "tail-faster" or
+        "fewer-failures" for every measure whose interval excludes no change; empty if none does.
+    """
+    flags = []
+    for name, label in (("median", ""), ("tail", "tail-")):
+        low, high = result[f"{name}_ratio_ci"]
+        ratio = result[f"{name}_ratio"]
+        if low > 1 and ratio >= 1 + min_effect:
+            flags.append(f"{label}slower")
+        elif high < 1 and ratio <= 1 / (1 + min_effect):
+            flags.append(f"{label}faster")
+    low, high = result["failure_difference_ci"]
+    if low > 0:
+        flags.append("more-failures")
+    elif high < 0:
+        flags.append("fewer-failures")
+    return flags
+
+def compare_campaigns(downloads, baseline, candidate, resamples=5000, confidence=0.95, tail=0.95, min_effect=0.1, pool_servers=False, seed=None):
+    """
+    Compares two campaigns of the downloads table, cell by cell.
+
+    Args:
+        downloads (dict): The downloads table of the store.
+        baseline (str): Campaign compared against.
+        candidate (str): Campaign being judged.
+        resamples (int): Bootstrap resamples per cell and measure.
+        confidence (float): Coverage of the intervals.
+        tail (float): Quantile used as tail latency.
+        min_effect (float): Smallest relative change flagged, e.g. 0.1 for 10%.
+        pool_servers (bool): Merge all servers into one cell.
+        seed (int, optional): Seed of the resampling, for repeatable intervals.
+
+    Returns:
+        list: One dict per cell in both campaigns, with its factors, the results
+        of `compare_cell` and its `flags`.
+    """
+    rng = np.random.default_rng(seed)
+    selected = np.isin(downloads["campaign"], [baseline, candidate])
+    downloads = {name: column[selected] for name, column in downloads.items()}
+    server = np.full(len(downloads["ref"]), "all") if pool_servers else downloads["server"]
+    factors = np.rec.fromarrays([downloads["size_kb"], downloads["ul_redundancy"], downloads["dl_redundancy"], server],
+                                names=["size_kb", "erasure", "strategy", "server"])
+
+    cells = []
+    in_baseline = downloads["campaign"] == baseline
+    in_candidate = downloads["campaign"] == candidate
+    keys, group = np.unique(factors, return_inverse=True)
+    group = group.ravel()
+    for index, key in enumerate(keys):
+        rows = group == index
+        a, b = rows & in_baseline, rows & in_candidate
+        if not a.any() or not b.any():
+            continue
+        result = compare_cell((downloads["time_sec"][a], downloads["sha256_match"][a]),
+                              (downloads["time_sec"][b], downloads["sha256_match"][b]),
+                              resamples, confidence, tail, rng)
+        cell = {
+            "size_kb": int(key["size_kb"]),
+            "erasure": ERASURE_NAMES.get(int(key["erasure"]), str(key["erasure"])),
+            "strategy": STRATEGY_NAMES.get(int(key["strategy"]), str(key["strategy"])),
+            "server": str(key["server"]),
+            **result
+        }
+        cell["flags"] = verdict(cell, min_effect)
+        cells.append(cell)
+    return cells
+
+def without_nan(value):
+    """Replaces NaN, which JSON does not allow, with None throughout a result."""
+    if isinstance(value, dict):
+        return {key: without_nan(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [without_nan(item) for item in value]
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+def print_table(cells, tail):
+    """Prints one line per cell: medians, ratios with intervals, failure rates and flags."""
+    tail_name = f"p{tail * 100:g}"
+    print(f"{'size_kb':>8} {'erasure':<8} {'strategy':<8} {'server':<16} {'n':>7} {'median_s':>15} "
+          f"{'median ratio':>22} {tail_name + ' ratio':>22} {'failures':>13} flags")
+    for cell in cells:
+        median_ci = "[{:.2f}, {:.2f}]".format(*cell["median_ratio_ci"])
+        tail_ci = "[{:.2f}, {:.2f}]".format(*cell["tail_ratio_ci"])
+        print(f"{cell['size_kb']:>8} {cell['erasure']:<8} {cell['strategy']:<8} {cell['server']:<16} "
+              f"{cell['n_baseline']:>3}/{cell['n_candidate']:<3} "
+              f"{cell['median_baseline']:>7.2f}/{cell['median_candidate']:<7.2f} "
+              f"{cell['median_ratio']:>7.2f} {median_ci:>14} {cell['tail_ratio']:>7.2f} {tail_ci:>14} "
+              f"{cell['failure_baseline']:>6.1%}/{cell['failure_candidate']:<6.1%} {','.join(cell['flags'])}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the download times of two campaigns with bootstrap confidence intervals.')
+    parser.add_argument('baseline', help='campaign to compare against, e.g. swarm-2025-07')
+    parser.add_argument('candidate', help='campaign being judged, e.g. swarm-2025-07_with_PR5097')
+    parser.add_argument('--data-dir', type=str, default='data', help='directory with one subdirectory per campaign')
+    parser.add_argument('--store', type=str, help=f'store file (default: <data-dir>/{STORE_FILE})')
+    parser.add_argument('--resamples', type=int, default=5000, help='bootstrap resamples per cell and measure')
+    parser.add_argument('--confidence', type=float, default=0.95, help='coverage of the confidence intervals')
+    parser.add_argument('--tail', type=float, default=0.95, help='quantile compared as tail latency')
+    parser.add_argument('--min-effect', type=float, default=0.1, help='smallest relative change flagged as regression or improvement')
+    parser.add_argument('--pool-servers', action='store_true', help='merge the servers instead of comparing each one')
+    parser.add_argument('--seed', type=int, help='seed of the resampling, for repeatable intervals')
+    parser.add_argument('--output', type=str, help='write the comparison to this JSON file')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with status 1 if any cell got slower or fails more')
+    args = parser.parse_args()
+
+    store_path = args.store or os.path.join(args.data_dir, STORE_FILE)
+    ingest(args.data_dir, store_path)
+    downloads = load_store(store_path)["downloads"]
+    for campaign in (args.baseline, args.candidate):
+        if not (downloads["campaign"] == campaign).any():
+            sys.exit(f"No downloads of campaign {campaign} in {store_path}")
+
+    start = time.perf_counter()
+    cells = compare_campaigns(downloads, args.baseline, args.candidate, args.resamples, args.confidence, args.tail,
+                              args.min_effect, args.pool_servers, args.seed)
+    elapsed = time.perf_counter() - start
+    print_table(cells, args.tail)
+
+    regressions = [cell for cell in cells if {"slower", "tail-slower", "more-failures"} & set(cell["flags"])]
+    improvements = [cell for cell in cells if {"faster", "tail-faster", "fewer-failures"} & set(cell["flags"])]
+    print(f"\n{args.candidate} vs {args.baseline}: {len(cells)} cells, {len(regressions)} regressions, "
+          f"{len(improvements)} improvements ({args.resamples} resamples per cell, {elapsed:.2f}s)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "baseline": args.baseline,
+                "candidate": args.candidate,
+                "resamples": args.resamples,
+                "confidence": args.confidence,
+                "tail": args.tail,
+                "min_effect": args.min_effect,
+                "regressions": len(regressions),
+                "improvements": len(improvements),
+                "cells": without_nan(cells),
+            }, f, indent=4)
+        logging.info(f"Comparison written to {args.output}")
+    if args.fail_on_regression and regressions:
+        sys.exit(1)
@@ -0,0 +1,412 @@
+#!/bin/python3
+"""Converts the results and references of every campaign into one columnar store.
+
+Each campaign directory under `data/` holds results files (`results*.json`, or
+the `results*.jsonl` journals written by app.py) and reference files
+(`references/*.json`, `references*.json[l]`). Every source file is parsed once
+into a block of typed NumPy columns, cached under `data/.ingest/` together with
+its size and modification time; later runs only parse files that changed.
+
+The blocks are then joined into the store, a single `.npz` file with two tables:
+
+- downloads: one row per download, joined to its upload by campaign and `ref`
+- uploads: one row per uploaded reference
+
+String columns are stored as integer codes plus their categories, so loading the
+store and querying every historical run takes a fraction of a second:
+
+    from ingest import load_store
+    downloads = load_store('data/results.npz')["downloads"]
+    swarm = downloads["storage"] == "Swarm"
+"""
+import argparse
+import datetime
+import glob
+import json
+import logging
+import os
+import re
+import time
+
+import numpy as np
+
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+
+STORE_FILE = 'results.npz'
+CACHE_DIR = '.ingest'
+
+# Column name -> NumPy type. 'U' columns are categorical in the store.
+DOWNLOAD_COLUMNS = {
+    "campaign": 'U',
+    "source": 'U',
+    "timestamp": 'datetime64[ms]',
+    "storage": 'U',
+    "server": 'U',
+    "ip": 'U',
+    "latitude": 'f8',
+    "longitude": 'f8',
+    "time_sec": 'f8',
+    "sha256_match": '?',
+    "attempts": 'i4',
+    "size_kb": 'i8',
+    "ref": 'U',
+    "dl_redundancy": 'i1',
+    "dl_retrieval_timeout_ms": 'f8',
+    "ul_redundancy": 'i1',
+}
+UPLOAD_COLUMNS = {
+    "campaign": 'U',
+    "source": 'U',
+    "storage": 'U',
+    "size_kb": 'i8',
+    "ref": 'U',
+    "sha256": 'U',
+    "upload_time": 'f8',
+    "upload_timestamp": 'datetime64[ms]',
+    "ul_redundancy": 'i1',
+}
+# Upload columns copied onto the download rows by the join
+JOINED_COLUMNS = ("upload_time", "upload_timestamp")
+
+# Missing integers are stored as -1, missing floats as NaN, missing times as NaT
+MISSING = {'i': -1, 'f': np.nan, 'M': np.datetime64('NaT'), 'U': '', 'b': False}
+
+STORAGE_NAMES = {"swarm": "Swarm", "ipfs": "Ipfs", "arweave": "Arweave"}
+
+TIMEOUT_PATTERN = re.compile(r'^\s*([0-9.]+)\s*(ms|s|m)?\s*$')
+TIMEOUT_UNITS = {"ms": 1, "s": 1000, "m": 60000, None: 1}
+
+def parse_timeout_ms(value):
+    """Turns a retrieval timeout such as "30000ms", "30s" or 30000 into milliseconds (NaN if unknown)."""
+    if value is None:
+        return np.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = TIMEOUT_PATTERN.match(str(value))
+    if not match:
+        return np.nan
+    return float(match.group(1)) * TIMEOUT_UNITS[match.group(2)]
+
+def parse_timestamp(value):
+    """Turns an ISO timestamp, with or without UTC offset, into a naive UTC datetime64 (NaT if missing)."""
+    if not value:
+        return np.datetime64('NaT')
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return np.datetime64('NaT')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return np.datetime64(parsed, 'ms')
+
+def to_int(value):
+    """Integer value of a number or numeric string; None and anything else become the missing value."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return MISSING['i']
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def make_block(rows, columns):
+    """Turns a list of row dicts into a dict of typed columns."""
+    block = {}
+    for name, dtype in columns.items():
+        values = [row.get(name, MISSING[np.dtype(dtype).kind]) for row in rows]
+        block[name] = np.array(values, dtype=dtype) if values else np.empty(0, dtype=dtype)
+    return block
+
+def download_row(result, storage, timestamp, campaign, source):
+    """Normalises one download result into a row of DOWNLOAD_COLUMNS."""
+    return {
+        "campaign": campaign,
+        "source": source,
+        "timestamp": parse_timestamp(timestamp),
+        "storage": storage or '',
+        "server": str(result.get("server") or ''),
+        "ip": str(result.get("ip") or ''),
+        "latitude": to_float(result.get("latitude")),
+        "longitude": to_float(result.get("longitude")),
+        "time_sec": to_float(result.get("download_time_seconds")),
+        "sha256_match": result.get("sha256_match") in ("true", True),
+        "attempts": to_int(result.get("attempts")),
+        "size_kb": to_int(result.get("size")),
+        "ref": str(result.get("ref") or ''),
+        "dl_redundancy": to_int(result.get("dl_redundancy")),
+        "dl_retrieval_timeout_ms": parse_timeout_ms(result.get("dl_retrieval-timeout")),
+        "ul_redundancy": to_int(result.get("ul_redundancy")),
+    }
+
+def parse_results(path, campaign, source):
+    """Parses a results JSON file or results journal into download rows."""
+    rows = []
+    if path.endswith('.jsonl'):
+        with open(path, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A journal cut short by a crash ends in a partial line
+                    logging.warning(f"Skipping a truncated line in {path}")
+                    continue
+                rows.append(download_row(record["result"], record.get("storage"), record.get("run"), campaign, source))
+    else:
+        with open(path, 'r') as f:
+            tests = json.load(f).get("tests", [])
+        for test in tests:
+            for result in test.get("results", []):
+                rows.append(download_row(result, test.get("storage"), test.get("timestamp"), campaign, source))
+    return make_block(rows, DOWNLOAD_COLUMNS)
+
+def reference_entries(path):
+    """Lists the (storage, size, entry) triples of a references JSON file."""
+    with open(path, 'r') as f:
+        references = json.load(f)
+    return [(storage, size, entry) for storage, sizes in references.items() for size, items in sizes.items() for entry in items]
+
+def parse_references(path, campaign, source):
+    """Parses a references JSON file or references journal into upload rows.
+
+    A journal is replayed on top of the JSON file next to it, as app.py's
+    `load_references` does, so the pair is one source.
+    """
+    if path.endswith('.jsonl'):
+        entries = []
+        if os.path.exists(path[:-1]):
+            entries = reference_entries(path[:-1])
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entries.append((record["storage"], record["size"], record["entry"]))
+    else:
+        entries = reference_entries(path)
+
+    rows = [{
+        "campaign": campaign,
+        "source": source,
+        "storage": STORAGE_NAMES.get(storage, storage),
+        "size_kb": to_int(size),
+        "ref": str(entry.get("hash") or ''),
+        "sha256": str(entry.get("sha256") or ''),
+        "upload_time": to_float(entry.get("upload_time")),
+        "upload_timestamp": parse_timestamp(entry.get("timestamp")),
+        "ul_redundancy": to_int(entry.get("ul_redundancy")),
+    } for storage, size, entry in entries]
+    return make_block(rows, UPLOAD_COLUMNS)
+
+def source_files(data_dir):
+    """
+    Lists the source files of every campaign.
+
+    A JSON file with a journal next to it (`results.json` and `results.jsonl`) is
+    left out: an exported results file repeats its journal, and a references
+    journal is parsed together with its JSON file.
+
+    Returns:
+        dict: Path relative to `data_dir` -> "downloads" or "uploads".
+    """
+    sources = {}
+    for pattern, table in (('*/results*.json', "downloads"), ('*/results*.jsonl', "downloads"),
+                           ('*/references/*.json', "uploads"), ('*/references/*.jsonl', "uploads"),
+                           ('*/references*.json', "uploads"), ('*/references*.jsonl', "uploads")):
+        for path in glob.glob(os.path.join(data_dir, pattern)):
+            if path.endswith('.json') and os.path.exists(path + 'l'):
+                continue
+            sources[os.path.relpath(path, data_dir)] = table
+    return sources
+
+def save_block(path, block):
+    np.savez(path, **block)
+
+def load_block(path):
+    with np.load(path, allow_pickle=False) as block:
+        return {name: block[name] for name in block.files}
+
+def concatenate(blocks, columns):
+    """Stacks blocks into one table; an empty list gives empty columns."""
+    if not blocks:
+        return make_block([], columns)
+    return {name: np.concatenate([block[name] for block in blocks]) for name in columns}
+
+def join_uploads(downloads, uploads):
+    """
+    Adds the upload columns to the download rows with the same campaign and ref.
+
+    If a reference was recorded more than once, the last upload row wins.
+    Downloads without a matching upload get missing values.
+    """
+    keys = np.char.add(np.char.add(uploads["campaign"], '/'), uploads["ref"])
+    download_keys = np.char.add(np.char.add(downloads["campaign"], '/'), downloads["ref"])
+    # Keep the last occurrence of every key: unique on the reversed array gives first indices there
+    unique_keys, reversed_index = np.unique(keys[::-1], return_index=True)
+    last = len(keys) - 1 - reversed_index
+    position = np.searchsorted(unique_keys, download_keys)
+    position = np.clip(position, 0, max(len(unique_keys) - 1, 0))
+    found = (unique_keys[position] == download_keys) if len(unique_keys) else np.zeros(len(download_keys), dtype=bool)
+
+    joined = dict(downloads)
+    for name in JOINED_COLUMNS:
+        column = np.full(len(download_keys), MISSING[uploads[name].dtype.kind], dtype=uploads[name].dtype)
+        if len(unique_keys):
+            column[found] = uploads[name][last[position[found]]]
+        joined[name] = column
+    return joined
+
+def encode_table(prefix, table):
+    """Turns a table into npz entries, storing string columns as codes plus categories."""
+    entries = {}
+    for name, column in table.items():
+        if column.dtype.kind == 'U':
+            categories, codes = np.unique(column, return_inverse=True)
+            entries[f"{prefix}.{name}"] = codes.astype(np.int32)
+            entries[f"{prefix}.{name}.categories"] = categories
+        else:
+            entries[f"{prefix}.{name}"] = column
+    return entries
+
+def load_store(path, decode=True):
+    """
+    Loads the store written by `ingest`.
+
+    Args:
+        path (str): The store file.
+        decode (bool): Turn categorical columns back into string arrays. Without
+            decoding, a categorical column is a (codes, categories) pair.
+
+    Returns:
+        dict: Table name ("downloads", "uploads") -> column name -> np.ndarray.
+    """
+    tables = {}
+    with np.load(path, allow_pickle=False) as store:
+        for key in store.files:
+            if key.endswith('.categories'):
+                continue
+            prefix, name = key.split('.', 1)
+            column = store[key]
+            if f"{key}.categories" in store.files:
+                categories = store[f"{key}.categories"]
+                column = categories[column] if decode else (column, categories)
+            tables.setdefault(prefix, {})[name] = column
+    return tables
+
+def ingest(data_dir, store_path, full=False):
+    """
+    Brings the store up to date with the campaign directories.
+
+    Args:
+        data_dir (str): Directory holding one subdirectory per campaign.
+        store_path (str): The store file to write.
+        full (bool): Parse every source file again, ignoring the cache.
+
+    Returns:
+        dict: Numbers of parsed, cached and removed files and of rows in each table.
+    """
+    cache_dir = os.path.join(data_dir, CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, 'index.json')
+    index = {}
+    if os.path.exists(index_path) and not full:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+
+    def block_path(source):
+        return os.path.join(cache_dir, source.replace(os.sep, '__') + '.npz')
+
+    sources = source_files(data_dir)
+    new_index = {}
+    parsed = 0
+    for source, table in sorted(sources.items()):
+        path = os.path.join(data_dir, source)
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        if table == "uploads" and path.endswith('.jsonl') and os.path.exists(path[:-1]):
+            # The journal is parsed with its JSON file; a change to either parses it again
+            twin = os.stat(path[:-1])
+            signature += [twin.st_size, twin.st_mtime_ns]
+        if index.get(source) == signature and os.path.exists(block_path(source)):
+            new_index[source] = signature
+            continue
+        campaign = source.split(os.sep, 1)[0]
+        try:
+            block = (parse_results if table == "downloads" else parse_references)(path, campaign, source)
+        except (json.JSONDecodeError, KeyError, AttributeError) as exc:
+            logging.error(f"Skipping {source}: {exc}")
+            continue
+        save_block(block_path(source), block)
+        new_index[source] = signature
+        parsed += 1
+
+    removed = [source for source in index if source not in new_index]
+    for source in removed:
+        if os.path.exists(block_path(source)):
+            os.remove(block_path(source))
+
+    stats = {"parsed": parsed, "cached": len(new_index) - parsed, "removed": len(removed)}
+    if parsed or removed or not os.path.exists(store_path) or full:
+        blocks = {"downloads": [], "uploads": []}
+        for source in sorted(new_index):
+            blocks[sources[source]].append(load_block(block_path(source)))
+        downloads = concatenate(blocks["downloads"], DOWNLOAD_COLUMNS)
+        uploads = concatenate(blocks["uploads"], UPLOAD_COLUMNS)
+        downloads = join_uploads(downloads, uploads)
+        temp_path = store_path + '.tmp.npz'
+        np.savez_compressed(temp_path, **encode_table("downloads", downloads), **encode_table("uploads", uploads))
+        os.replace(temp_path, store_path)
+        stats.update(downloads=len(downloads["ref"]), uploads=len(uploads["ref"]))
+
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump(new_index, f)
+    os.replace(index_path + '.tmp', index_path)
+    return stats
+
+def summary(store_path):
+    """Prints downloads, success rate and median time per campaign, storage and size from the store."""
+    start = time.perf_counter()
+    downloads = load_store(store_path, decode=False)["downloads"]
+    campaign_codes, campaigns = downloads["campaign"]
+    storage_codes, storages = downloads["storage"]
+    size = downloads["size_kb"]
+    ok = downloads["sha256_match"]
+    time_sec = downloads["time_sec"]
+
+    groups = np.stack([campaign_codes, storage_codes, size], axis=1)
+    keys, group = np.unique(groups, axis=0, return_inverse=True)
+    group = group.ravel()
+    order = np.argsort(group, kind='stable')
+    bounds = np.searchsorted(group[order], np.arange(len(keys) + 1))
+    elapsed = time.perf_counter() - start
+
+    print(f"{'campaign':<30} {'storage':<8} {'size_kb':>8} {'downloads':>10} {'ok':>7} {'median_s':>9}")
+    for (campaign, storage, size_kb), begin, end in zip(keys, bounds[:-1], bounds[1:]):
+        rows = order[begin:end]
+        successful = time_sec[rows][ok[rows]]
+        median = np.median(successful) if len(successful) else np.nan
+        print(f"{campaigns[campaign]:<30} {storages[storage]:<8} {size_kb:>8} {len(rows):>10} {ok[rows].mean():>7.1%} {median:>9.2f}")
+    print(f"\nLoaded and grouped {len(size)} downloads in {elapsed:.3f}s")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest campaign results and references into one columnar store.')
+    parser.add_argument('data_dir', nargs='?', default='data', help='directory with one subdirectory per campaign')
+    parser.add_argument('--store', type=str, help=f'store file (default: <data_dir>/{STORE_FILE})')
+    parser.add_argument('--full', action='store_true', help='parse every file again instead of only the changed ones')
+    parser.add_argument('--summary', action='store_true', help='print a per-campaign summary from the store afterwards')
+    args = parser.parse_args()
+
+    store_path = args.store or os.path.join(args.data_dir, STORE_FILE)
+    start = time.perf_counter()
+    stats = ingest(args.data_dir, store_path, args.full)
+    logging.info(f"Ingested {args.data_dir} into {store_path} in {time.perf_counter() - start:.2f}s: {stats}")
+    if args.summary:
+        summary(store_path)
@@ -0,0 +1,42 @@
+"""Tests for ingest.py, run with `python3 -m pytest analysis-code`."""
+import json
+
+import numpy as np
+
+from ingest import ingest, load_store
+
+RUN = "2026-01-05T10:00:00+00:00"
+
+def write_json_lines(path, records):
+    path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+
+def make_campaign(data_dir):
+    """A campaign as app.py leaves it: results journal with its export, references JSON with a journal."""
+    campaign = data_dir / "swarm-test"
+    campaign.mkdir(parents=True)
+    results = [{"server": "node", "ip": "10.0.0.1:1633", "download_time_seconds": 0.5 + n, "sha256_match": "true",
+                "attempts": 1, "size": "1", "ref": f"ref{n}", "dl_redundancy": 0, "dl_retrieval-timeout": "30000ms",
+                "ul_redundancy": 0} for n in range(3)]
+    write_json_lines(campaign / "results_onlyswarm.jsonl",
+                     [{"test": f"{RUN}/Swarm", "run": RUN, "storage": "Swarm", "size_kb": "1", "result": result} for result in results])
+    (campaign / "results_onlyswarm.json").write_text(json.dumps(
+        {"tests": [{"timestamp": RUN, "size_kb": "1", "storage": "Swarm", "results": results}]}))
+
+    entry = lambda n: {"hash": f"ref{n}", "sha256": "00", "upload_time": 1.0, "timestamp": RUN, "ul_redundancy": 0}
+    (campaign / "references_onlyswarm.json").write_text(json.dumps({"swarm": {"1": [entry(0), entry(1)]}}))
+    write_json_lines(campaign / "references_onlyswarm.jsonl", [{"storage": "swarm", "size": "1", "entry": entry(2)}])
+    return campaign
+
+def test_journal_and_export_are_ingested_once(tmp_path):
+    make_campaign(tmp_path)
+    ingest(str(tmp_path), str(tmp_path / "results.npz"))
+    store = load_store(str(tmp_path / "results.npz"))
+    assert len(store["downloads"]["ref"]) == 3
+    assert sorted(store["uploads"]["ref"]) == ["ref0", "ref1", "ref2"]
+
+def test_journal_rows_have_the_run_timestamp(tmp_path):
+    make_campaign(tmp_path)
+    ingest(str(tmp_path), str(tmp_path / "results.npz"))
+    timestamps = load_store(str(tmp_path / "results.npz"))["downloads"]["timestamp"]
+    assert not np.isnat(timestamps).any()
+    assert (timestamps == np.datetime64("2026-01-05T10:00:00", 'ms')).all()
@@ -3,17 +3,14 @@ import os
 import random
 import argparse
 import json
-import requests
 import hashlib
 import time
 import signal
 import sys
 import prometheus_client
 import string
-import paramiko
 import subprocess
-import ipinfo
-import asyncio, asyncssh, aiohttp
+import asyncio, aiohttp
 import logging
 import socket
 import tempfile
@@ -22,14 +19,18 @@ import re
 import json
 import datetime
 import pytz
-import gzip
+import zlib
+import contextlib
+import abc
+import secrets
+import ipaddress
+import math
+import statistics
 
 from pathlib import Path
 from aiohttp import ClientSession, ClientConnectionError, ClientResponseError
-from Crypto.Hash import keccak
-from prometheus_client import CollectorRegistry, Counter, Summary, Histogram, Gauge, push_to_gateway
+from prometheus_client import CollectorRegistry, Counter, Summary, Histogram, Gauge, push_to_gateway, start_http_server
 from prometheus_client.exposition import basic_auth_handler
-from ritual_arweave.file_manager import FileManager
 
 job_label=None
 
@@ -50,16 +51,9 @@ references_file_onlyswarm = "references_onlyswarm.json"
 results_file = "results.json"
 results_file_onlyswarm = "results_onlyswarm.json"
 
-# Read existing references from the file
-if os.path.exists(references_file):
-    with open(references_file, 'r') as f:
-        references = json.load(f)
-else:
-    references = {"swarm": {}, "ipfs": {}, "arweave": {}}
-
 # Load configuration from file or environment variables
 def load_config(config_file):
-    global username, ipinfo_token, prometheus_gw, prometheus_pw, prometheus_user, ipfs_data_dir, swarm_ul_server, swarm_dl_servers, ipfs_ul_server, ipfs_dl_servers, arw_ul_server, arw_dl_servers, swarm_batch_id
+    global username, ipinfo_token, prometheus_gw, prometheus_pw, prometheus_user, ipfs_data_dir, swarm_ul_server, swarm_dl_servers, ipfs_ul_server, ipfs_dl_servers, arw_ul_server, arw_dl_servers, swarm_batch_id, ssh_workers
     with open(config_file, 'r') as f:
         config = json.load(f)
 
@@ -76,6 +70,8 @@ def load_config(config_file):
     prometheus_user = os.getenv('PROMETHEUS_USER', config['prometheus_user'])
 
     username = os.getenv('USERNAME', config['username'])
+    # SSH host -> Bee servers (as seen from that host) its worker downloads from
+    ssh_workers = config.get('ssh_workers', {})
     ipinfo_token = os.getenv('IPINFO_TOKEN', config['ipinfo_token'])
     ipfs_data_dir = os.getenv('IPFS_DATA_DIR', config['ipfs_data_dir'])
     ipfs_ul_server = os.getenv('IPFS_UL_SERVER', config['ipfs_ul_server'])
@@ -114,27 +110,27 @@ def pgw_auth_handler(url, method, timeout, headers, data):
 registry = CollectorRegistry()
 NO_MATCH = Counter('util_web3_storage_sha_fail',
                        'failed to download a file that would match',
-                       labelnames=['storage', 'server', 'latitude', 'longitude', 'size'],
+                       labelnames=['storage', 'server', 'size'],
                        registry=registry)
 
 REPEAT_NO_MATCH = Counter('util_web3_storage_repeat_sha_fail',
                        'failed to download a file that would match',
-                       labelnames=['storage', 'server', 'latitude', 'longitude', 'size'],
+                       labelnames=['storage', 'server', 'size'],
                        registry=registry)
 
 OLD_NO_MATCH = Counter('util_web3_storage_old_sha_fail',
                        'failed to download a file that would match',
-                       labelnames=['storage', 'server', 'latitude', 'longitude', 'size'],
+                       labelnames=['storage', 'server', 'size'],
                        registry=registry)
 
 DL_TIME = Summary('util_web3_storage_download_time',
                        'Time spent processing request',
-                       labelnames=['storage', 'server', 'latitude', 'longitude', 'size', 'dl_redundancy', 'ul_redundancy', 'dl_retrieval'],
+                       labelnames=['storage', 'server', 'size', 'dl_redundancy', 'ul_redundancy', 'dl_retrieval'],
                        registry=registry)
 
 DL_TIME_SUM = Histogram('util_web3_storage_download_time_summary',
                        'Time spent processing request',
-                       labelnames=['storage', 'server', 'latitude', 'longitude', 'size'],
+                       labelnames=['storage', 'server', 'size'],
                        buckets=[
                            0,
                            1,
@@ -150,17 +146,17 @@ DL_TIME_SUM = Histogram('util_web3_storage_download_time_summary',
 
 DL_TIME_EXTREMES = Gauge('util_web3_storage_download_extremes',
                        'winners and loosers',
-                       labelnames=['storage', 'server', 'latitude', 'longitude', 'size'],
+                       labelnames=['storage', 'server', 'size'],
                        registry=registry)
 
 REPEAT_DL_TIME = Gauge('util_web3_storage_repeat_download_time',
                        'Time spent processing request',
-                       labelnames=['storage', 'server', 'latitude', 'longitude', 'size'],
+                       labelnames=['storage', 'server', 'size'],
                        registry=registry)
 
 REPEAT_DL_TIME_SUM = Histogram('util_web3_storage_repeat_download_summary',
                        'winners and loosers',
-                       labelnames=['storage', 'server', 'latitude', 'longitude', 'size'],
+                       labelnames=['storage', 'server', 'size'],
                        buckets=[
                            0, 
                            1, 
@@ -176,12 +172,12 @@ REPEAT_DL_TIME_SUM = Histogram('util_web3_storage_repeat_download_summary',
 
 OLD_DL_TIME = Gauge('util_web3_storage_old_download_time',
                        'Time spent processing request',
-                       labelnames=['storage', 'server', 'latitude', 'longitude', 'size'],
+                       labelnames=['storage', 'server', 'size'],
                        registry=registry)
 
 OLD_DL_TIME_SUM = Histogram('util_web3_storage_old_download_summary',
                        'winners and loosers',
-                       labelnames=['storage', 'server', 'latitude', 'longitude', 'size'],
+                       labelnames=['storage', 'server', 'size'],
                        buckets=[
                            0, 
                            1, 
@@ -195,47 +191,795 @@ OLD_DL_TIME_SUM = Histogram('util_web3_storage_old_download_summary',
                        ],
                        registry=registry)
 
-def save_test_results(results, filename):
-    """Saves test results to a JSON file.
+SERVER_INFO = Gauge('util_web3_storage_server_info',
+                       'Geolocation of a download server, always 1; join on `server` to place other metrics on a map',
+                       labelnames=['server', 'latitude', 'longitude', 'city', 'country'],
+                       registry=registry)
+
+DL_TIME_QUANTILE = Gauge('util_web3_storage_download_time_quantile',
+                       'Quantiles of successful download times from a quantile sketch with 1% relative error; server "all" merges the servers',
+                       labelnames=['storage', 'server', 'size', 'ul_redundancy', 'dl_redundancy', 'quantile'],
+                       registry=registry)
+
+DL_PHASE_TIME = Histogram('util_web3_storage_download_phase_time',
+                       'Time spent in one phase of a successful download request',
+                       labelnames=['storage', 'server', 'size', 'phase'],
+                       buckets=[
+                           0.001,
+                           0.005,
+                           0.01,
+                           0.025,
+                           0.05,
+                           0.1,
+                           0.25,
+                           0.5,
+                           1,
+                           2.5,
+                           5,
+                           10,
+                           30,
+                           60,
+                           300,
+                           float('inf')  # Infinity for the last bucket
+                       ],
+                       registry=registry)
+
+DL_BODY_RATE = Summary('util_web3_storage_download_body_rate',
+                       'Body transfer throughput of a successful download in bytes per second',
+                       labelnames=['storage', 'server', 'size'],
+                       registry=registry)
+
+CHUNK_TIME = Histogram('util_web3_storage_chunk_retrieval_time',
+                       'Time to retrieve one chunk through /chunks in chunk mode',
+                       labelnames=['server', 'size', 'depth'],
+                       buckets=[
+                           0.005,
+                           0.01,
+                           0.025,
+                           0.05,
+                           0.1,
+                           0.25,
+                           0.5,
+                           1,
+                           2.5,
+                           5,
+                           10,
+                           30,
+                           float('inf')  # Infinity for the last bucket
+                       ],
+                       registry=registry)
+
+RANGE_TIME = Histogram('util_web3_storage_range_read_time',
+                       'Time to first byte and to completion of Range requests in ranges mode',
+                       labelnames=['storage', 'server', 'length', 'stat'],
+                       buckets=[
+                           0.005,
+                           0.01,
+                           0.025,
+                           0.05,
+                           0.1,
+                           0.25,
+                           0.5,
+                           1,
+                           2.5,
+                           5,
+                           10,
+                           30,
+                           float('inf')  # Infinity for the last bucket
+                       ],
+                       registry=registry)
+
+LOAD_STEP = Gauge('util_web3_storage_load_step',
+                       'Throughput, latency percentiles and error rate of each load test level',
+                       labelnames=['op', 'server', 'concurrency', 'stat'],
+                       registry=registry)
+
+RACE_WINS = Counter('util_web3_storage_race_wins',
+                       'Races won by a server in --race mode',
+                       labelnames=['storage', 'server', 'size'],
+                       registry=registry)
+
+DL_ATTEMPTS = Counter('util_web3_storage_download_attempts',
+                       'Download requests by outcome (ok, status, mismatch, error, cancelled)',
+                       labelnames=['storage', 'server', 'size', 'outcome', 'hedged'],
+                       registry=registry)
+
+TIME_TO_RETRIEVABLE = Histogram('util_web3_storage_time_to_retrievable',
+                       'Time from upload until a probe node confirmed the data retrievable',
+                       labelnames=['storage', 'size', 'ul_redundancy'],
+                       buckets=[
+                           10,
+                           30,
+                           60,
+                           120,
+                           300,
+                           600,
+                           900,
+                           1800,
+                           3600,
+                           7200,
+                           float('inf')  # Infinity for the last bucket
+                       ],
+                       registry=registry)
+
+http_session = None
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Content encodings stream_body can decode; sent with every hashed download so no other comes back
+DOWNLOAD_HEADERS = {"Accept-Encoding": "gzip, deflate, identity"}
+UPLOAD_CHUNK_SIZE = 64 * 1024
+PAYLOAD_CHUNK_SIZE = 1024 * 1024
+
+def new_http_session():
+    """Creates the run-wide aiohttp session with a pooled, keep-alive connector.
+
+    Returns:
+        aiohttp.ClientSession: A session whose connector caps connections per host
+        and caches DNS answers.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=args.conn_limit,
+        limit_per_host=args.conn_limit_per_host,
+        keepalive_timeout=args.keepalive_timeout,
+        ttl_dns_cache=args.dns_cache_ttl)
+    return aiohttp.ClientSession(connector=connector, trace_configs=[phase_trace_config()])
+
+def phase_trace_config():
+    """Builds a TraceConfig that timestamps the phases of a request.
+
+    Requests made with a dict as `trace_request_ctx` get `time.perf_counter()`
+    stamps written into it: DNS resolution, connection setup, request headers
+    sent and response headers received. Other requests are left alone.
+    """
+    trace_config = aiohttp.TraceConfig()
+
+    def stamp(name):
+        async def on_event(session, trace_config_ctx, params):
+            trace = trace_config_ctx.trace_request_ctx
+            if isinstance(trace, dict):
+                trace[name] = time.perf_counter()
+        return on_event
+
+    trace_config.on_request_start.append(stamp('request_start'))
+    trace_config.on_dns_resolvehost_start.append(stamp('dns_start'))
+    trace_config.on_dns_resolvehost_end.append(stamp('dns_end'))
+    trace_config.on_connection_create_start.append(stamp('connect_start'))
+    trace_config.on_connection_create_end.append(stamp('connect_end'))
+    trace_config.on_connection_reuseconn.append(stamp('connection_reused'))
+    trace_config.on_request_headers_sent.append(stamp('headers_sent'))
+    trace_config.on_request_end.append(stamp('headers_received'))
+    return trace_config
+
+def download_phases(trace):
+    """Turns the stamps of one traced request into phase durations.
+
+    aiohttp reports connection setup as a single span, so `connect` covers the
+    TCP connect and, for https, the TLS handshake; DNS is reported separately.
 
     Args:
-        results (list): A list of test result dictionaries.
-        filename (str, optional): The name of the JSON file. Defaults to "results.json".
+        trace (dict): The stamps collected by `phase_trace_config` and `stream_body`.
+
+    Returns:
+        dict: Phase durations in seconds plus body transfer figures.
     """
-    try:
-        with open(filename, 'r+') as file:
-            data = json.load(file)
-            data["tests"].extend(results)
-            file.seek(0)  # Rewind to the beginning of the file
-            json.dump(data, file, indent=4)
-    except FileNotFoundError:
-        with open(filename, 'w') as file:
-            json.dump({"tests": results}, file, indent=4)
+    def span(start, end):
+        if start in trace and end in trace:
+            return trace[end] - trace[start]
+        return 0.0
+
+    dns = span('dns_start', 'dns_end')
+    connect = max(span('connect_start', 'connect_end') - dns, 0.0)
+    body = span('headers_received', 'body_end')
+    body_bytes = trace.get('body_bytes', 0)
+    steady_bytes = body_bytes - trace.get('first_mb_bytes', body_bytes)
+    steady = span('first_mb', 'body_end')
+    return {
+        "dns": dns,
+        "connect": connect,
+        "ttfb": span('headers_sent', 'headers_received'),
+        "body": body,
+        "body_bytes": body_bytes,
+        "body_bytes_per_second": body_bytes / body if body > 0 else None,
+        "first_mb": span('headers_sent', 'first_mb') if 'first_mb' in trace else None,
+        "steady_bytes_per_second": steady_bytes / steady if steady > 0 else None,
+        "connection_reused": 'connection_reused' in trace
+    }
+
+def body_decoder(encoding):
+    """
+    Returns a decompressor for a Content-Encoding, or None for an unencoded body.
+
+    Raises:
+        ValueError: If the body is in an encoding stream_body cannot decode.
+    """
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(wbits=31)
+    if encoding == 'deflate':
+        return zlib.decompressobj(wbits=15)
+    if encoding == 'identity':
+        return None
+    raise ValueError(f"unsupported Content-Encoding {encoding}")
+
+async def stream_body(response, trace):
+    """Reads a response body chunk by chunk and hashes it as it arrives.
+
+    Gzip- and deflate-encoded bodies are decompressed on the fly, so the request
+    must be made with `auto_decompress=False` and `DOWNLOAD_HEADERS`. Memory use stays at one chunk regardless of the
+    file size. Transfer stamps (`first_mb`, `body_end`) and byte counts go into
+    `trace` for `download_phases`.
+
+    Args:
+        response (aiohttp.ClientResponse): The response to read.
+        trace (dict): The trace dict of the request.
+
+    Returns:
+        str: The SHA256 hex digest of the (decompressed) body.
+
+    Raises:
+        zlib.error: If an encoded body is corrupt or truncated.
+        ValueError: If the body is in an encoding that cannot be decoded.
+    """
+    sha256 = hashlib.sha256()
+    gunzip = body_decoder(response.headers.get('Content-Encoding'))
+    received = 0
+
+    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+        received += len(chunk)
+        if 'first_mb' not in trace and received >= 1024 * 1024:
+            trace['first_mb'] = time.perf_counter()
+            trace['first_mb_bytes'] = received
+        sha256.update(gunzip.decompress(chunk) if gunzip else chunk)
+
+    if gunzip:
+        sha256.update(gunzip.flush())
+        if not gunzip.eof:
+            raise zlib.error("truncated encoded body")
+
+    trace['body_end'] = time.perf_counter()
+    trace['body_bytes'] = received
+    return sha256.hexdigest()
+
+@contextlib.asynccontextmanager
+async def download_session():
+    """Yields the session a single download should use.
+
+    With `--connection warm` this is the shared pooled session, so the download
+    reuses open connections. With `--connection cold` every download gets its own
+    session and pays for DNS, TCP and TLS setup, like runs made before pooling.
+    """
+    if args.connection == 'warm' and http_session is not None:
+        yield http_session
+    else:
+        async with aiohttp.ClientSession(trace_configs=[phase_trace_config()]) as session:
+            yield session
+
+class JsonLinesLog:
+    """Append-only JSON Lines file, written one record at a time.
+
+    Every record is flushed to the OS as soon as it is appended, so a crashed
+    process loses nothing; fsync is batched to every `fsync_every` records or
+    `fsync_interval` seconds, whichever comes first. A partial last line left by
+    a crash mid-write is cut off on open, so new records start on a line of their own.
+    """
+
+    def __init__(self, filename, fsync_every=20, fsync_interval=5.0):
+        self.filename = filename
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.pending = 0
+        self.last_sync = time.monotonic()
+        self.drop_partial_line()
+        self.file = open(filename, 'a')
+
+    def drop_partial_line(self):
+        """Truncates the file after its last newline if it does not end in one."""
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, 'r+b') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                step = min(4096, position)
+                f.seek(position - step)
+                block = f.read(step)
+                newline = block.rfind(b'\n')
+                if newline != -1:
+                    position = position - step + newline + 1
+                    break
+                position -= step
+            if position != end:
+                logging.warning(f"Dropping a partial last line of {end - position} bytes in {self.filename}")
+                f.truncate(position)
+
+    def append(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        self.pending += 1
+        if self.pending >= self.fsync_every or time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.pending:
+            self.sync()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_json_lines(filename):
+    """Reads the records of a JSON Lines file.
+
+    A last line torn by a crash mid-write is skipped with a warning.
+
+    Args:
+        filename (str): The JSON Lines file.
+
+    Returns:
+        list: The records, or an empty list if the file does not exist.
+    """
+    records = []
+    if not os.path.exists(filename):
+        return records
+    with open(filename, 'r') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                logging.warning(f"Skipping unreadable line {number} in {filename}")
+    return records
+
+def write_json_atomic(data, filename):
+    """Writes JSON to a temporary file and renames it over `filename`, so readers
+    never see a half-written file."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    with tempfile.NamedTemporaryFile('w', dir=directory, delete=False, suffix='.tmp') as tmp:
+        json.dump(data, tmp, indent=4)
+        tmp.flush()
+        os.fsync(tmp.fileno())
+    os.replace(tmp.name, filename)
+
+def open_results_log(filename):
+    """Opens the append-only log behind a results JSON file.
+
+    The log lives next to the JSON file with an `l` appended (`results.json` ->
+    `results.jsonl`). If only an older JSON file exists, its tests are copied
+    into the log first, so the next export does not lose them.
+
+    Args:
+        filename (str): The results JSON file, e.g. "results_onlyswarm.json".
+
+    Returns:
+        JsonLinesLog: The log, open for appending.
+    """
+    log_filename = filename + 'l'
+    migrate = os.path.exists(filename) and not os.path.exists(log_filename)
+    results_log = JsonLinesLog(log_filename)
+    if migrate:
+        with open(filename, 'r') as f:
+            tests = json.load(f).get("tests", [])
+        for number, test in enumerate(tests):
+            for result in test["results"]:
+                results_log.append({"test": f"{filename}#{number}", "run": test["timestamp"], "storage": test["storage"], "size_kb": test["size_kb"], "result": result})
+        results_log.sync()
+        logging.info(f"Copied {len(tests)} tests from {filename} into {log_filename}")
+    return results_log
+
+def export_results(filename):
+    """Compacts the results log into the `{"tests": [...]}` layout read by compile-data.R.
+
+    Records are grouped into tests (one per run and storage), in the order they were logged.
+
+    Args:
+        filename (str): The results JSON file to (re)write from its log.
+    """
+    tests = {}
+    for record in read_json_lines(filename + 'l'):
+        test = tests.setdefault(record["test"], {
+            "timestamp": record["run"],
+            "size_kb": record["size_kb"],
+            "storage": record["storage"],
+            "results": []
+        })
+        test["size_kb"] = record["size_kb"]
+        test["results"].append(record["result"])
+    write_json_atomic({"tests": list(tests.values())}, filename)
+
+def load_references(filename):
+    """Loads references from their JSON file and replays the journal next to it.
+
+    Uploads append to `<filename>l` one entry at a time; the journal is folded
+    into the JSON file by `compact_references` once the upload phase is over.
+    A journal left behind by a crash is replayed here.
+
+    Args:
+        filename (str): The references JSON file.
+
+    Returns:
+        dict: References keyed by storage and size, or None if neither file exists.
+    """
+    journal = filename + 'l'
+    if not os.path.exists(filename) and not os.path.exists(journal):
+        return None
+    references = {"swarm": {}, "ipfs": {}}
+    if os.path.exists(filename):
+        with open(filename, 'r') as f:
+            references = json.load(f)
+    for record in read_json_lines(journal):
+        references.setdefault(record["storage"], {}).setdefault(record["size"], []).append(record["entry"])
+    return references
+
+def compact_references(references, filename):
+    """Writes the references JSON file atomically and drops its journal."""
+    write_json_atomic(references, filename)
+    if os.path.exists(filename + 'l'):
+        os.remove(filename + 'l')
+
+class CampaignState:
+    """Records which cells of a campaign are done, one JSON line per cell.
+
+    A cell is a dict of factor values, e.g. {"phase": "download", "size": "1000",
+    "ul_redundancy": 2, "dl_redundancy": 3, "replicate": 7, "server": "..."}.
+    The file only ever grows, so it survives crashes and reboots; `--resume`
+    uses it to skip work that was already done. With `resume=False` the cells in
+    the file are not read, so only cells done in this run count as done.
+    """
+
+    def __init__(self, filename, resume=True):
+        self.done = {self.key(cell) for cell in read_json_lines(filename)} if resume else set()
+        self.log = JsonLinesLog(filename, fsync_every=1)
+
+    @staticmethod
+    def key(cell):
+        return json.dumps(cell, sort_keys=True)
+
+    def is_done(self, cell):
+        return self.key(cell) in self.done
+
+    def mark_done(self, cell):
+        if not self.is_done(cell):
+            self.done.add(self.key(cell))
+            self.log.append(cell)
+
+    def close(self):
+        self.log.close()
+
+def run_cell(args):
+    """The (size, ul_redundancy, dl_redundancy) cell of `--campaign` a single invocation works on."""
+    return {"phase": "cell", "campaign": args.campaign, "size": str(args.size), "ul_redundancy": args.ul_redundancy, "dl_redundancy": args.dl_redundancy}
+
+def archive_references(filename, directory, ul_redundancy, dl_redundancy):
+    """Moves a finished references file into `directory`, named like the files in data/*/references."""
+    os.makedirs(directory, exist_ok=True)
+    stem, ext = os.path.splitext(os.path.basename(filename))
+    stamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M')
+    target = os.path.join(directory, f"{stem}_{ul_redundancy}_{dl_redundancy}_{stamp}{ext}")
+    os.replace(filename, target)
+    logging.info(f"Archived {filename} to {target}")
+
+def result_to_dict(result, dl_redundancy, dl_retrieval):
+    """Turns the tuple returned by a download function into a results record."""
+    elapsed_time, sha256sum_output, server_loc, server, ip, attempts, storage, size, reference, redundancy, details = result
+    result_dict = {
+        "server": server,
+        "ip": ip,
+        "latitude": server_loc.latitude if server_loc else None,
+        "longitude": server_loc.longitude if server_loc else None,
+        "download_time_seconds": elapsed_time,
+        "sha256_match": sha256sum_output,
+        "attempts": attempts,
+        "size": size,
+        "ref": reference,
+        "dl_redundancy": dl_redundancy,
+        "dl_retrieval-timeout": dl_retrieval,
+        "ul_redundancy": redundancy
+    }
+    result_dict.update(details)
+    return result_dict
+
+def record_download(result, results_log, run_timestamp, dl_redundancy, dl_retrieval, tags=None):
+    """Appends one download result to the results log.
+
+    Args:
+        result (tuple): The tuple returned by a download function.
+        results_log (JsonLinesLog): The results log.
+        run_timestamp (str): Identifies the run the result belongs to.
+        dl_redundancy (int): The retrieval strategy used.
+        dl_retrieval (str): The chunk retrieval timeout used.
+        tags (dict, optional): Extra fields for the record, e.g. campaign factors.
+
+    Returns:
+        dict: The results record.
+    """
+    result_dict = result_to_dict(result, dl_redundancy, dl_retrieval)
+    result_dict.update(tags or {})
+    storage, size = result[6], result[7]
+    results_log.append({"test": f"{run_timestamp}/{storage}", "run": run_timestamp, "storage": storage, "size_kb": size, "result": result_dict})
+    return result_dict
+
+class LatencySketch:
+    """Mergeable quantile sketch with a relative error guarantee (DDSketch).
+
+    Values are counted in logarithmic buckets; every quantile comes back within
+    `relative_accuracy` of the true value, from 1 ms to hours alike, using a few
+    hundred buckets at most. Sketches with the same accuracy merge by adding counts.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        if value <= 1e-9:
+            self.zero_count += 1
+        else:
+            index = math.ceil(math.log(value) / self.log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """Adds the counts of a sketch with the same accuracy into this one."""
+        if other.gamma != self.gamma:
+            raise ValueError("Only sketches with the same relative accuracy can be merged")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """The q-quantile (0 <= q <= 1), or None for an empty sketch."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+SKETCH_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+latency_sketches = {}  # (storage, server, size, ul_redundancy, dl_redundancy) -> LatencySketch
+
+def observe_latency(storage, server, size, ul_redundancy, dl_redundancy, seconds):
+    """Adds a download time to the sketch of its cell and exports the cell's quantiles, per server and merged."""
+    cell = (storage, server, size, ul_redundancy, dl_redundancy)
+    latency_sketches.setdefault(cell, LatencySketch()).add(seconds)
+
+    merged = LatencySketch()
+    for (other_storage, _, other_size, other_ul, other_dl), sketch in latency_sketches.items():
+        if (other_storage, other_size, other_ul, other_dl) == (storage, size, ul_redundancy, dl_redundancy):
+            merged.merge(sketch)
+    for label, sketch in ((server, latency_sketches[cell]), ('all', merged)):
+        for q in SKETCH_QUANTILES:
+            DL_TIME_QUANTILE.labels(storage=storage, server=label, size=size, ul_redundancy=ul_redundancy,
+                                    dl_redundancy=dl_redundancy, quantile=str(q)).set(sketch.quantile(q))
+
+def observe_download(result, dl_redundancy, dl_retrieval):
+    """Logs one download result and records it in the Prometheus metrics."""
+    elapsed_time, sha256sum_output, server_loc, server, ip, attempts, storage, size, reference, redundancy, details = result
+    if server_loc:
+        location = server_loc.all
+        SERVER_INFO.labels(server=server, latitude=location.get("latitude"), longitude=location.get("longitude"),
+                           city=location.get("city"), country=location.get("country")).set(1)
+
+    logging.info("-----------------START-----------------------")
+    logging.info(f"size: {size}kb")
+    logging.info(f"{storage} initial download time: {elapsed_time} seconds from {server_loc.city if server_loc else 'Unknown'} - {server} within {attempts} attempts. Size {size} ")
+    if "race" in details and sha256sum_output == 'true':
+        RACE_WINS.labels(storage=storage, server=server, size=size).inc()
+    for record in details.get("attempt_log", []):
+        DL_ATTEMPTS.labels(storage=storage, server=server, size=size, outcome=record["outcome"], hedged=str(record["hedged"]).lower()).inc()
+
+    if sha256sum_output == 'true':
+        logging.info("SHA256 hashes match.")
+        DL_TIME.labels(storage=storage, server=server, size=size, dl_redundancy=dl_redundancy, ul_redundancy=redundancy, dl_retrieval=dl_retrieval).observe(elapsed_time)
+        DL_TIME_SUM.labels(storage=storage, server=server, size=size).observe(elapsed_time)
+        observe_latency(storage, server, size, redundancy, dl_redundancy, elapsed_time)
+        phases = details.get("phases")
+        if phases:
+            for phase in ("dns", "connect", "ttfb", "body"):
+                DL_PHASE_TIME.labels(storage=storage, server=server, size=size, phase=phase).observe(phases[phase])
+            if phases["body_bytes_per_second"]:
+                DL_BODY_RATE.labels(storage=storage, server=server, size=size).observe(phases["body_bytes_per_second"])
+            logging.info(f"Phases: dns {phases['dns']:.3f}s, connect {phases['connect']:.3f}s, ttfb {phases['ttfb']:.3f}s, body {phases['body']:.3f}s")
+    else:
+        logging.info("SHA256 hashes do !NOT! match.")
+        NO_MATCH.labels(storage=storage, server=server, size=size).inc()
+    logging.info("-----------------END-------------------------")
+
+class MetricsExporter:
+    """Pushes the registry to the pushgateway in the background.
+
+    Recording a result only marks the registry dirty; a background task pushes it
+    at most once per interval, backing off while the pushgateway is unreachable.
+    With `pull` set the registry is only served for scraping and never pushed.
+    """
+
+    def __init__(self, interval=15.0, max_backoff=300.0):
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.pull = False
+        self.dirty = False
+        self.task = None
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def start(self, interval=None, metrics_port=None):
+        """Starts pushing, or serves `/metrics` on `metrics_port` instead."""
+        if interval is not None:
+            self.interval = interval
+        if metrics_port:
+            start_http_server(metrics_port, registry=registry)
+            self.pull = True
+            logging.info(f"Serving metrics on port {metrics_port}")
+            return
+        self.task = asyncio.create_task(self.run())
+
+    def push(self):
+        push_to_gateway(prometheus_gw, job=job_label, registry=registry, handler=pgw_auth_handler)
+
+    async def run(self):
+        delay = self.interval
+        while True:
+            await asyncio.sleep(delay)
+            if not self.dirty:
+                continue
+            self.dirty = False
+            try:
+                await asyncio.to_thread(self.push)
+                delay = self.interval
+            except Exception as exc:
+                self.dirty = True
+                delay = min(delay * 2, self.max_backoff)
+                logging.warning(f"Push to gateway failed, retrying in {delay:.0f}s: {exc}")
+
+    def flush(self):
+        """Pushes pending changes right away, e.g. on exit."""
+        if self.pull or not self.dirty:
+            return
+        self.dirty = False
+        try:
+            self.push()
+        except Exception as exc:
+            logging.error(f"Final push to gateway failed: {exc}")
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+        await asyncio.to_thread(self.flush)
+
+metrics_exporter = MetricsExporter()
 
 def signal_handler(sig, frame):
     global args
     # This function will be called when Ctrl+C is pressed
     logging.info("Ctrl+C pressed. Cleaning up or running specific code...")
-    push_to_gateway(prometheus_gw, job=job_label, registry=registry, handler=pgw_auth_handler)
+    metrics_exporter.flush()
     sys.exit(0)  # Exit the script gracefully
 
-ipinfo_cache = {}
+LOOKUP_CACHE_FILE = '.lookup_cache.json'
+DNS_CACHE_TTL = 3600
+IPINFO_CACHE_TTL = 30 * 24 * 3600
+
+lookup_cache_file = LOOKUP_CACHE_FILE
+lookup_cache = None
+lookup_tasks = {}
+
+def load_lookup_cache():
+    """Returns the on-disk lookup cache, reading it on first use."""
+    global lookup_cache
+    if lookup_cache is None:
+        try:
+            with open(lookup_cache_file, 'r') as f:
+                lookup_cache = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            lookup_cache = {}
+    return lookup_cache
+
+async def cached_lookup(kind, key, ttl, lookup):
+    """
+    Returns a lookup result from the on-disk cache, or runs the lookup and stores it.
+
+    Concurrent callers for the same key share one lookup, so every server is resolved
+    at most once per run. Failed lookups (None) are neither stored nor shared.
+
+    Args:
+        kind (str): The cache section, e.g. "dns" or "ipinfo".
+        key (str): The cache key within the section.
+        ttl (int): How long a stored result stays valid, in seconds.
+        lookup (callable): Coroutine function performing the actual lookup.
+
+    Returns:
+        The cached or freshly looked-up value, or None if the lookup failed.
+    """
+    section = load_lookup_cache().setdefault(kind, {})
+    entry = section.get(key)
+    if entry and entry["expires"] > time.time():
+        return entry["value"]
+
+    task = lookup_tasks.get((kind, key))
+    if task is None:
+        task = lookup_tasks[(kind, key)] = asyncio.ensure_future(lookup())
+    value = await task
+    if value is None:
+        lookup_tasks.pop((kind, key), None)
+        return None
+
+    entry = section.get(key)
+    if not entry or entry["expires"] <= time.time():
+        section[key] = {"value": value, "expires": time.time() + ttl}
+        write_json_atomic(lookup_cache, lookup_cache_file)
+    return value
+
+def ipinfo_details(details):
+    """Wraps a cached ipinfo lookup (a dict) in the ipinfo Details type the results use."""
+    import ipinfo
+    return ipinfo.details.Details(details)
 
 async def get_ipinfo(ip):
-    global ipinfo_token
+    """
+    Looks up the geolocation of a server without blocking the event loop.
 
-    if ip in ipinfo_cache:
-        return ipinfo_cache[ip]
+    Args:
+        ip: The IP address (or DNS name, with or without protocol and port) of the server.
 
-    ipinfo_handler = ipinfo.getHandler(ipinfo_token)
-    server_loc = ipinfo_handler.getDetails(get_ip_from_dns(ip))
+    Returns:
+        The ipinfo details of the server, or None if it could not be looked up.
+    """
+    global ipinfo_token
 
-    # Cache the result
-    ipinfo_cache[ip] = server_loc
+    ip = await resolve_host(ip) if ip else None
+    if ip is None:
+        return None
+    ip, _ = extract_port(ip)
+    if not ipaddress.ip_address(ip).is_global:
+        return None  # ipinfo has nothing on private and loopback addresses
+
+    async def lookup():
+        try:
+            import ipinfo
+            ipinfo_handler = ipinfo.getHandler(ipinfo_token)
+            details = await asyncio.to_thread(ipinfo_handler.getDetails, ip)
+            return details.all
+        except Exception as exc:
+            logging.warning(f"ipinfo lookup failed for {ip}: {exc}")
+            return None
 
-    return server_loc
+    details = await cached_lookup("ipinfo", ip, IPINFO_CACHE_TTL, lookup)
+    return ipinfo_details(details) if details is not None else None
 
 def fetch_data(url):
+    import requests
     response = requests.get(url)
     response.raise_for_status()
     return response.json()
@@ -256,23 +1000,41 @@ def generate_random_string(length):
 #
 #    return json.dumps(data)
 
-def generate_random_binary_data(size_in_kb):
+def random_payload(size_in_kb, seed, sha256=None):
     """
-    Generates random binary data of the specified size in kilobytes.
+    Generates a reproducible random payload of the specified size in fixed-size buffers.
+
+    The bytes come from a PRNG seeded with `seed`, so storing the seed is enough to
+    regenerate the exact file later. Only one buffer is held in memory at a time.
 
     Args:
-        size_in_kb (int): The size of the binary data to generate in kilobytes.
+        size_in_kb (int): The size of the payload to generate in kilobytes.
+        seed (int): The PRNG seed.
+        sha256 (hashlib object, optional): Updated with every buffer as it is generated.
 
-    Returns:
-        bytes: A bytes object containing the random binary data.
+    Yields:
+        bytes: Consecutive buffers of at most PAYLOAD_CHUNK_SIZE bytes.
     """
-    size_in_bytes = size_in_kb * 1024
-    return os.urandom(size_in_bytes)
-
-def get_ip_from_dns(dns_name):
+    rng = random.Random(seed)
+    remaining = size_in_kb * 1024
+    while remaining > 0:
+        chunk = rng.randbytes(min(PAYLOAD_CHUNK_SIZE, remaining))
+        if sha256 is not None:
+            sha256.update(chunk)
+        remaining -= len(chunk)
+        yield chunk
+
+def new_payload_seed():
+    """Returns a fresh seed, so every upload is a unique random file."""
+    return secrets.randbits(64)
+
+async def resolve_host(dns_name):
     """
     This function attempts to resolve a DNS name and return the IP address.
 
+    Resolution runs on the event loop's resolver and is cached on disk, so it neither
+    blocks nor repeats for a server already seen.
+
     Args:
         dns_name: The DNS name to resolve, which may include a protocol (http/https), a port, or neither.
 
@@ -296,16 +1058,19 @@ def get_ip_from_dns(dns_name):
     if ip_pattern.match(host):
         return dns_name  # Return the original input if it's an IP address with or without port
 
-    try:
-        # Use socket.gethostbyname to resolve the DNS name
-        ip_address = socket.gethostbyname(host)
-        return ip_address
-    except socket.gaierror:
-        # Handle potential DNS resolution errors
-        print(f"Error resolving DNS name: {dns_name}")
-        return None
+    async def lookup():
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, None, family=socket.AF_INET, type=socket.SOCK_STREAM)
+            return infos[0][4][0]
+        except socket.gaierror:
+            # Handle potential DNS resolution errors
+            logging.error(f"Error resolving DNS name: {dns_name}")
+            return None
+
+    return await cached_lookup("dns", host, DNS_CACHE_TTL, lookup)
 
 async def kill_existing_processes(server, username, output_file):
+    import asyncssh
     async with asyncssh.connect(server, username=username) as conn:
         """Kill processes using the specified output file."""
         find_process_command = f"ps -ef | grep {output_file} | awk '{{print $2}}'"
@@ -324,79 +1089,224 @@ def extract_port(url):
         port = None
     return ip,port
 
-async def handle_response(response, url, attempt):
-    content = await response.read()
-
+async def handle_response(response, url, attempt, trace):
     if 200 <= response.status <= 299:
-        if response.headers.get('Content-Encoding') == 'gzip':
-            try:
-                content = gzip.decompress(content)
-                logging.info(f"Successful gzip decompression on attempt {attempt} for {url}")
-            except gzip.BadGzipFile:
-                logging.error(f"Failed to decompress gzip response on attempt {attempt} for {url}")
-                return None
+        try:
+            sha256sum_output = await stream_body(response, trace)
+        except (zlib.error, ValueError) as exc:
+            logging.error(f"Failed to decode response on attempt {attempt} for {url}: {exc}")
+            return None
         logging.info(f"Successful fetch on attempt {attempt} for {url}")
-        return content
+        return sha256sum_output
     else:
         logging.warning(f"Unexpected status code {response.status} on attempt {attempt} for {url}")
     return None
 
-async def http_curl(url, swarmhash, expected_sha256, max_attempts, size, redundancy):
+attempt_durations = {}
+HEDGE_MIN_SAMPLES = 10
+
+def percentile(values, q):
+    """Returns the `q`th percentile (0-100) of `values` by nearest rank, or None if there are none."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+def hedge_delay(size):
+    """
+    Returns how long an attempt may run before a hedged second request is started.
+
+    The delay is the `--hedge-percentile` of the successful attempts of this size seen
+    so far in this run, or `--hedge-after` until enough attempts have been seen.
+
+    Args:
+        size (str): The file size in kb.
+
+    Returns:
+        float: The delay in seconds, or None if hedging is off.
+    """
+    if not args.hedge_percentile:
+        return None
+    durations = attempt_durations.get(size, [])
+    if len(durations) < HEDGE_MIN_SAMPLES:
+        return args.hedge_after
+    return percentile(durations, args.hedge_percentile)
+
+def retry_delay(attempt):
+    """Returns the jittered exponential backoff before retry number `attempt`."""
+    if not args.retry_backoff:
+        return 0
+    return random.uniform(0, min(args.retry_backoff * 2 ** (attempt - 1), args.retry_backoff_max))
+
+async def http_curl(url, swarmhash, expected_sha256, max_attempts, size, redundancy, dl_redundancy=None, dl_retrieval=None):
     global args
     storage = 'Swarm'
     ip, port = extract_port(url)
+    dl_redundancy = args.dl_redundancy if dl_redundancy is None else dl_redundancy
+    dl_retrieval = args.dl_retrieval if dl_retrieval is None else dl_retrieval
 
-    server_loc = await get_ipinfo(get_ip_from_dns(ip))
+    server_ip = await resolve_host(ip)
+    server_loc = await get_ipinfo(server_ip)
     initial_start_time = time.time()
 
     headers = {
         "swarm-redundancy-fallback-mode": "False",
-        "swarm-chunk-retrieval-timeout": str(args.dl_retrieval),
-        "swarm-redundancy-strategy": str(args.dl_redundancy) 
+        "swarm-chunk-retrieval-timeout": str(dl_retrieval),
+        "swarm-redundancy-strategy": str(dl_redundancy),
+        **DOWNLOAD_HEADERS
     }
-    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=100000)) as session:
-        for attempt in range(1, max_attempts + 1):
+    timeout = aiohttp.ClientTimeout(total=100000)
+    if port:
+        base_url_https = f'https://{ip}:{port}/bzz/{swarmhash}'
+        base_url_http = f'http://{ip}:{port}/bzz/{swarmhash}'
+    else:
+        base_url_https = f'https://{ip}/bzz/{swarmhash}'
+        base_url_http = f'http://{ip}/bzz/{swarmhash}'
+    attempts = []
+
+    async def fetch(session, attempt, hedged):
+        """Runs one request and appends its record to `attempts`, also when cancelled."""
+        record = {"attempt": attempt, "hedged": hedged, "status": None, "outcome": "error"}
+        trace = {}
+        start = time.time()
+        try:
             try:
-                if port:
-                    base_url_https = f'https://{ip}:{port}/bzz/{swarmhash}'
-                    base_url_http = f'http://{ip}:{port}/bzz/{swarmhash}'
-                else:
-                    base_url_https = f'https://{ip}/bzz/{swarmhash}'
-                    base_url_http = f'http://{ip}/bzz/{swarmhash}'
+                async with session.get(base_url_http, headers=headers, timeout=timeout, trace_request_ctx=trace, auto_decompress=False) as response:
+                    record["status"] = response.status
+                    sha256sum_output = await stream_body(response, trace) if response.status == 200 else None
+            except aiohttp.ClientConnectorSSLError:
+                logging.warning(f"SSL error, retrying with HTTPS for {url}")
+                trace = {}
+                async with session.get(base_url_https, headers=headers, timeout=timeout, trace_request_ctx=trace, auto_decompress=False) as response:
+                    record["status"] = response.status
+                    sha256sum_output = await stream_body(response, trace) if response.status == 200 else None
+
+            if record["status"] != 200:
+                record["outcome"] = "status"
+                logging.warning(f"Unexpected status code {record['status']} on attempt {attempt} for {url}")
+            elif sha256sum_output != expected_sha256:
+                record["outcome"] = "mismatch"
+                logging.warning(f"SHA256 mismatch on attempt {attempt} for {url}")
+            else:
+                record["outcome"] = "ok"
+                logging.info(f"Successful fetch on attempt {attempt} for {url}")
+        except asyncio.CancelledError:
+            record["outcome"] = "cancelled"
+            raise
+        except Exception as exc:
+            record["error"] = str(exc)
+            logging.error(f"HTTP error on attempt {attempt} for {url}: {exc}")
+        finally:
+            record["duration"] = time.time() - start
+            attempts.append(record)
+        return record, trace
+
+    async def hedged_fetch(session, attempt):
+        """Runs one attempt, racing a second request once the first runs past the hedge delay."""
+        first = asyncio.create_task(fetch(session, attempt, False))
+        delay = hedge_delay(size)
+        if delay is None or (await asyncio.wait({first}, timeout=delay))[0]:
+            return await first
+        logging.info(f"Attempt {attempt} for {url} passed {delay:.3f}s, sending a hedged request")
+        pending = {first, asyncio.create_task(fetch(session, attempt, True))}
+        result = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if result[0]["outcome"] == "ok":
+                    for loser in pending:
+                        loser.cancel()
+                    await asyncio.gather(*pending, return_exceptions=True)
+                    return result
+        return result
+
+    async with download_session() as session:
+        for attempt in range(1, max_attempts + 1):
+            if attempt > 1:
+                await asyncio.sleep(retry_delay(attempt - 1))
+            record, trace = await hedged_fetch(session, attempt)
+            if record["outcome"] == "ok":
+                elapsed_time = time.time() - initial_start_time
+                attempt_durations.setdefault(size, []).append(record["duration"])
+                details = {"phases": download_phases(trace), "attempt_log": attempts}
+                return elapsed_time, 'true', server_loc, server_ip, url, attempt, storage, size, swarmhash, redundancy, details
 
-                try:
-                    async with session.get(base_url_http, headers=headers) as response:
-                        content = await response.read()
-                        if response.status == 200:
-                            logging.info(f"Successful HTTPS fetch on attempt {attempt} for {url}")
-                except aiohttp.ClientConnectorSSLError:
-                    logging.warning(f"SSL error, retrying with HTTP for {url}")
-                    async with session.get(base_url_https, headers=headers) as response:
-                        content = await response.read()
-                        if response.status == 200:
-                            logging.info(f"Successful HTTP fetch on attempt {attempt} for {url}")
+    total_elapsed_time = time.time() - initial_start_time
+    return 0, 'false', server_loc, server_ip, url, max_attempts, storage, size, swarmhash, redundancy, {"attempt_log": attempts}
 
-                elapsed_time = time.time() - initial_start_time
-                sha256sum_output = hashlib.sha256(content).hexdigest()
+async def race_download(servers, swarmhash, expected_sha256, max_attempts, size, redundancy, dl_redundancy=None, dl_retrieval=None):
+    """
+    Downloads one reference from all servers at once; the first verified body wins.
 
-                if sha256sum_output == expected_sha256:
-                    return elapsed_time, 'true', server_loc, get_ip_from_dns(ip), url, attempt, storage, size, swarmhash, redundancy
+    Losers are cancelled once the winner is in, or after `--race-grace` seconds so
+    that close runners-up can still finish and show the spread.
 
-            except Exception as exc:
-                logging.error(f"HTTP error on attempt {attempt} for {url}: {exc}")
+    Args:
+        servers (list): The Swarm download servers to race.
+        swarmhash (str), expected_sha256 (str), max_attempts (int), size (str), redundancy: As for `http_curl`.
 
-    total_elapsed_time = time.time() - initial_start_time
-    return 0, 'false', server_loc, get_ip_from_dns(ip), url, max_attempts, storage, size, swarmhash, redundancy
+    Returns:
+        tuple: The result of the winning `http_curl`, with the race timed from its common
+        start and described under `race` in the details; a failed result if no server won.
+    """
+    # Resolve everything up front so no lookup runs inside the race
+    for server in servers:
+        await get_ipinfo(await resolve_host(extract_port(server)[0]))
+
+    start = time.time()
+    tasks = {asyncio.create_task(http_curl(server, swarmhash, expected_sha256, max_attempts, size, redundancy, dl_redundancy, dl_retrieval)): server
+             for server in servers}
+    outcomes = {server: {"outcome": "cancelled"} for server in servers}
+    winner = None
+    deadline = None
+    pending = set(tasks)
+    while pending:
+        timeout = None if deadline is None else max(0, deadline - time.time())
+        done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            break
+        for task in done:
+            server = tasks[task]
+            latency = time.time() - start
+            result = None if task.exception() else task.result()
+            if result is not None and result[1] == 'true':
+                outcomes[server] = {"outcome": "lost" if winner else "won", "latency": latency}
+                if winner is None:
+                    winner = result
+                    deadline = time.time() + args.race_grace
+            else:
+                outcomes[server] = {"outcome": "failed", "latency": latency}
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    if winner is None:
+        return 0, 'false', None, None, 'race', max_attempts, 'Swarm', size, swarmhash, redundancy, {"race": {"servers": outcomes}}
+
+    verified = sorted(o["latency"] for o in outcomes.values() if o["outcome"] in ("won", "lost"))
+    race = {
+        "winner": winner[4],
+        "latency": verified[0],
+        "spread": verified[-1] - verified[0],
+        "finished": len(verified),
+        "servers": outcomes,
+    }
+    logging.info(f"Race for {swarmhash} won by {race['winner']} in {race['latency']:.3f}s, {len(verified)} of {len(servers)} verified, spread {race['spread']:.3f}s")
+    elapsed_time, sha256sum_output, server_loc, server, ip, attempts, storage, size, reference, redundancy, details = winner
+    return verified[0], sha256sum_output, server_loc, server, ip, attempts, storage, size, reference, redundancy, dict(details, race=race)
 
 async def http_ipfs(url, cid, expected_sha256, max_attempts, size):
     global args
     storage = 'Ipfs'
     ip, port = extract_port(url)
 
-    server_loc = await get_ipinfo(get_ip_from_dns(ip))
+    server_ip = await resolve_host(url)
+    server_loc = await get_ipinfo(server_ip)
     initial_start_time = time.time()
 
-    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=1000)) as session:
+    timeout = aiohttp.ClientTimeout(total=1000)
+    async with download_session() as session:
         for attempt in range(1, max_attempts + 1):
             try:
                 if port:
@@ -408,38 +1318,42 @@ async def http_ipfs(url, cid, expected_sha256, max_attempts, size):
 
                 try:
                     # Try fetching over HTTP first
-                    async with session.get(base_url_http) as response:
-                        content = await handle_response(response, base_url_http, attempt)
-                        if content:
-                            sha256sum_output = hashlib.sha256(content).hexdigest()
+                    trace = {}
+                    async with session.get(base_url_http, headers=DOWNLOAD_HEADERS, timeout=timeout, trace_request_ctx=trace, auto_decompress=False) as response:
+                        sha256sum_output = await handle_response(response, base_url_http, attempt, trace)
+                        if sha256sum_output:
                             if sha256sum_output == expected_sha256:
                                 logging.debug(f"IPFS: SHA256 hashes match on attempt {attempt} for {url}")
                                 elapsed_time = time.time() - initial_start_time
-                                return elapsed_time, 'true', server_loc, get_ip_from_dns(url), url, attempt, storage, size, cid, None
+                                details = {"phases": download_phases(trace)}
+                                return elapsed_time, 'true', server_loc, server_ip, url, attempt, storage, size, cid, None, details
 
                 except aiohttp.ClientConnectorSSLError:
                     logging.warning(f"SSL error, retrying with HTTPS for {url}")
                     # Retry with HTTPS in case of SSL errors
-                    async with session.get(base_url_https) as response:
-                        content = await handle_response(response, base_url_https, attempt)
-                        if content:
-                            sha256sum_output = hashlib.sha256(content).hexdigest()
+                    trace = {}
+                    async with session.get(base_url_https, headers=DOWNLOAD_HEADERS, timeout=timeout, trace_request_ctx=trace, auto_decompress=False) as response:
+                        sha256sum_output = await handle_response(response, base_url_https, attempt, trace)
+                        if sha256sum_output:
                             if sha256sum_output == expected_sha256:
                                 logging.debug(f"IPFS: SHA256 hashes match on attempt {attempt} for {url}")
                                 elapsed_time = time.time() - initial_start_time
-                                return elapsed_time, 'true', server_loc, get_ip_from_dns(url), url, attempt, storage, size, cid
+                                details = {"phases": download_phases(trace)}
+                                return elapsed_time, 'true', server_loc, server_ip, url, attempt, storage, size, cid, None, details
             except Exception as exc:
                 logging.error(f"IPFS: HTTP error on attempt {attempt} for {url}: {exc}")
 
         total_elapsed_time = time.time() - initial_start_time
         logging.debug(f"IPFS: Failed after {max_attempts} attempts for {url}")
-        return 0, 'false', server_loc, get_ip_from_dns(url), url, max_attempts, storage, size, cid, None
+        return 0, 'false', server_loc, server_ip, url, max_attempts, storage, size, cid, None, {}
 
 async def http_arw(url, transaction_id, expected_sha256, max_attempts, size):
     global args
     storage = 'Arweave'
-    server_loc = await get_ipinfo(get_ip_from_dns(url))
+    server_ip = await resolve_host(url)
+    server_loc = await get_ipinfo(server_ip)
 
+    from ritual_arweave.file_manager import FileManager
     arw_file_manager = FileManager(gateways=url, wallet_path='./arw_wallet.json')
 
     initial_start_time = time.time()
@@ -457,7 +1371,7 @@ async def http_arw(url, transaction_id, expected_sha256, max_attempts, size):
 
                 if sha256sum_output == expected_sha256:
                     logging.debug(f"ARW: SHA256 hashes match on attempt {attempt} for {url}")
-                    return elapsed_time, 'true', server_loc, get_ip_from_dns(url), url, attempt, storage, size, transaction_id, None
+                    return elapsed_time, 'true', server_loc, server_ip, url, attempt, storage, size, transaction_id, None, {}
 
             except Exception as exc:
                 pass
@@ -469,21 +1383,431 @@ async def http_arw(url, transaction_id, expected_sha256, max_attempts, size):
 
     total_elapsed_time = time.time() - initial_start_time
     logging.debug(f"ARW: Failed after {max_attempts} attempts for {url}")
-    return 0, 'false', server_loc, get_ip_from_dns(url), url, max_attempts, storage, size, transaction_id, None
+    return 0, 'false', server_loc, server_ip, url, max_attempts, storage, size, transaction_id, None, {}
+
+class StorageBackend(abc.ABC):
+    """
+    A storage platform the harness measures, behind one async interface.
+
+    Backends are created by `get_backend` the first time a run selects them, so a
+    platform's client library and credentials are only loaded when it is measured;
+    a Swarm-only run never imports the Arweave or IPFS clients.
+    """
+    storage = None
+
+    @abc.abstractmethod
+    async def download(self, url, reference, expected_sha256, max_attempts, size, redundancy=None, **options):
+        """
+        Downloads `reference` from the gateway `url` and checks its SHA256.
+
+        Args:
+            options: Platform-specific download settings, e.g. `dl_redundancy` for Swarm.
+
+        Returns:
+            tuple: The download result tuple.
+        """
+
+    @abc.abstractmethod
+    async def upload(self, size_kb, seed, replicate, ul_redundancy=0):
+        """
+        Uploads a random file of `size_kb` generated from `seed`.
+
+        Returns:
+            dict: The references entry ("hash", "sha256", "seed", "upload_time",
+            "timestamp", ...), or None if the upload failed.
+        """
+
+class SwarmBackend(StorageBackend):
+    """Swarm through a Bee node. Uploads stream the payload straight from its generator."""
+    storage = 'Swarm'
+
+    async def download(self, url, reference, expected_sha256, max_attempts, size, redundancy=None, **options):
+        return await http_curl(url, reference, expected_sha256, max_attempts, size, redundancy, **options)
+
+    async def race(self, servers, reference, expected_sha256, max_attempts, size, redundancy=None, **options):
+        """Downloads `reference` from all `servers` at once, see `race_download`."""
+        return await race_download(servers, reference, expected_sha256, max_attempts, size, redundancy, **options)
+
+    async def upload(self, size_kb, seed, replicate, ul_redundancy=0):
+        _, entry = await upload_swarm_replicate(size_kb, ul_redundancy, replicate, seed)
+        return entry
+
+class FileUploadBackend(StorageBackend):
+    """A platform whose client uploads files from disk; the payload is written to `ipfs_data_dir` first."""
+
+    @abc.abstractmethod
+    async def upload_path(self, path, name):
+        """
+        Uploads the file at `path` under `name`.
+
+        Returns:
+            dict: "hash", "upload_time" and "timestamp" of the upload, or None if it failed.
+        """
+
+    async def upload(self, size_kb, seed, replicate, ul_redundancy=0):
+        sha256 = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=ipfs_data_dir, delete=False, mode='wb', suffix='.bin') as tmpfile:
+            for chunk in random_payload(size_kb, seed, sha256):
+                tmpfile.write(chunk)
+        try:
+            uploaded = await self.upload_path(tmpfile.name, f'speedtest-{size_kb}kb-{replicate}')
+        finally:
+            os.remove(tmpfile.name)
+        if not uploaded:
+            return None
+        return {"hash": uploaded["hash"], "sha256": sha256.hexdigest(), "seed": seed,
+                "upload_time": uploaded["upload_time"], "timestamp": uploaded["timestamp"]}
+
+class IpfsBackend(FileUploadBackend):
+    """IPFS, uploaded through Pinata and downloaded from public gateways."""
+    storage = 'Ipfs'
+
+    def __init__(self):
+        self.jwt = load_pinata_credentials()
+
+    async def download(self, url, reference, expected_sha256, max_attempts, size, redundancy=None, **options):
+        return await http_ipfs(url, reference, expected_sha256, max_attempts, size)
+
+    async def upload_path(self, path, name):
+        start = time.time()
+        response = await pin_file_to_ipfs(self.jwt, path, name)
+        duration = time.time() - start
+        if not response:
+            logging.warning(f"Pinata upload of {name} failed")
+            return None
+        logging.info(f'Successfully uploaded file to Pinata. IPFS Hash: {response["IpfsHash"]}, Pin Size: {response["PinSize"]}, Timestamp: {response["Timestamp"]}')
+        return {"hash": response['IpfsHash'], "upload_time": duration, "timestamp": response['Timestamp']}
+
+class ArweaveBackend(FileUploadBackend):
+    """Arweave through ritual_arweave, with the wallet in arw_wallet.json."""
+    storage = 'Arweave'
 
-def upload_file(data, url_list):
+    def __init__(self):
+        from ritual_arweave.file_manager import FileManager
+        self.file_manager = FileManager(gateways=arw_ul_server, wallet_path='./arw_wallet.json')
+
+    async def download(self, url, reference, expected_sha256, max_attempts, size, redundancy=None, **options):
+        return await http_arw(url, reference, expected_sha256, max_attempts, size)
+
+    async def upload_path(self, path, name):
+        start = time.time()
+        response = await asyncio.to_thread(self.file_manager.upload, path, tags_dict={'filename': path})
+        duration = time.time() - start
+        logging.info(f'Upload to arweave duration: {duration}')
+        if not response.id:
+            logging.warning(f"Failed to get transaction ID from Arweave response. Response: {response}")
+            return None
+        logging.info(f'Successfully uploaded file to ARWEAVE. transaction: {response.id}')
+        return {"hash": response.id, "upload_time": duration, "timestamp": datetime.datetime.now(pytz.utc).isoformat()}
+
+BACKENDS = {"swarm": SwarmBackend, "ipfs": IpfsBackend, "arweave": ArweaveBackend}
+backends = {}
+
+def get_backend(key):
+    """Returns the backend of a references key ("swarm", "ipfs" or "arweave"), creating it on first use."""
+    if key not in backends:
+        backends[key] = BACKENDS[key]()
+    return backends[key]
+
+async def upload_body(chunks, trace):
+    """Yields the upload payload chunk by chunk and stamps when the last one was handed over.
+
+    The time spent generating the buffers is summed into `trace['generate']`, so
+    it can be taken out of the upload time.
+
+    Args:
+        chunks (iterable): The payload buffers, e.g. from `random_payload`.
+        trace (dict): The trace dict of the upload request.
+    """
+    chunks = iter(chunks)
+    trace['generate'] = 0.0
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        trace['generate'] += time.perf_counter() - start
+        if chunk is None:
+            break
+        for offset in range(0, len(chunk), UPLOAD_CHUNK_SIZE):
+            yield chunk[offset:offset + UPLOAD_CHUNK_SIZE]
+    trace['body_sent'] = time.perf_counter()
+
+def upload_phases(trace):
+    """Turns the stamps of one traced upload into phase durations.
+
+    Args:
+        trace (dict): The stamps collected by `phase_trace_config` and `upload_body`.
+
+    Returns:
+        dict: `connect` (DNS and connection setup), `send` (request headers and body
+        written, without generating the payload), `response` (body written until the
+        response headers arrived) and `generate` (payload generation), in seconds.
+    """
+    def span(start, end):
+        if start in trace and end in trace:
+            return trace[end] - trace[start]
+        return 0.0
+
+    return {
+        "connect": span('connect_start', 'connect_end'),
+        "send": max(0.0, span('headers_sent', 'body_sent') - trace.get('generate', 0.0)),
+        "response": span('body_sent', 'headers_received'),
+        "generate": trace.get('generate', 0.0),
+        "connection_reused": 'connection_reused' in trace
+    }
+
+async def upload_file(chunks, size_in_bytes, url_list, ul_redundancy=None):
+    """Uploads a payload to Swarm over the shared connection pool.
+
+    The body is streamed from a generator instead of being handed to the HTTP
+    client in one piece, and the event loop stays free while it is sent.
+
+    Args:
+        chunks (iterable): The payload buffers, e.g. from `random_payload`.
+        size_in_bytes (int): Total payload size, sent as Content-Length.
+        url_list (list): Upload servers; the first one is used, over HTTPS unless it names a scheme.
+        ul_redundancy (int, optional): Erasure coding level. Defaults to `--ul-redundancy`.
+
+    Returns:
+        tuple: (HTTP status, parsed JSON response or {}, {"upload_phases": dict}).
+    """
     global args,swarm_batch_id
     headers = {
         "Content-Type": "application/x-bin",
-        "swarm-redundancy-level": str(args.ul_redundancy),
+        "Content-Length": str(size_in_bytes),
+        "swarm-redundancy-level": str(args.ul_redundancy if ul_redundancy is None else ul_redundancy),
         "swarm-cache": "false",
         "swarm-postage-batch-id": swarm_batch_id,
         "swarm-deferred-upload": "False"
     }
-    url = f"https://{url_list[0]}"
+    url = url_list[0] if '://' in url_list[0] else f"https://{url_list[0]}"
+
+    trace = {}
+    async with http_session.post(url, data=upload_body(chunks, trace), headers=headers,
+                                 timeout=aiohttp.ClientTimeout(total=10000), trace_request_ctx=trace) as response:
+        try:
+            response_data = await response.json(content_type=None)
+        except ValueError:
+            response_data = {}
+        return response.status, response_data or {}, {"upload_phases": upload_phases(trace)}
+
+def bee_api_url(upload_url):
+    """Base URL of the Bee API behind an upload URL like host:port/bzz; https unless it names a scheme, as for uploads."""
+    url = upload_url if '://' in upload_url else f'https://{upload_url}'
+    url = url.rstrip('/')
+    return url[:-len('/bzz')] if url.endswith('/bzz') else url
+
+async def fetch_chunk(api_url, reference):
+    """
+    Fetches one chunk through Bee's /chunks endpoint and checks its address.
+
+    Args:
+        api_url (str): Base URL of the Bee API.
+        reference (str): The chunk address.
+
+    Returns:
+        bytes: The chunk, span followed by payload.
+
+    Raises:
+        ValueError: If the chunk does not hash to `reference`.
+    """
+    async with http_session.get(f'{api_url}/chunks/{reference}', timeout=aiohttp.ClientTimeout(total=120)) as response:
+        response.raise_for_status()
+        data = await response.read()
+    from swarm_bmt import chunk_address
+    if chunk_address(data).hex() != reference:
+        raise ValueError(f"Chunk {reference} does not match its address")
+    return data
+
+async def manifest_data_reference(api_url, reference):
+    """
+    Finds the data reference of a file uploaded through /bzz.
+
+    /bzz wraps the file in a mantaray manifest; its index document is the file,
+    which is looked up by walking the manifest nodes from the root.
+
+    Args:
+        api_url (str): Base URL of the Bee API.
+        reference (str): The manifest reference returned by the upload.
+
+    Returns:
+        str: The hex reference of the file data, or None if the manifest has no index document.
+    """
+    from swarm_bmt import parse_manifest_node, SPAN_SIZE
+    root = parse_manifest_node((await fetch_chunk(api_url, reference))[SPAN_SIZE:])
+    index = root["forks"].get(ord('/'))
+    path = index["metadata"].get("website-index-document") if index else None
+    if not path:
+        return None
+
+    path = path.encode()
+    node = root
+    while path:
+        fork = node["forks"].get(path[0])
+        if fork is None or not path.startswith(fork["prefix"]):
+            return None
+        path = path[len(fork["prefix"]):]
+        node = parse_manifest_node((await fetch_chunk(api_url, fork["reference"]))[SPAN_SIZE:])
+    return node["entry"]
+
+async def verify_upload(reference, size_kb, ul_redundancy, seed):
+    """
+    Checks that an uploaded file is the one we generated, without downloading it.
+
+    The data reference in the manifest is compared with the reference computed
+    locally from `seed`. Only the few manifest chunks are fetched, from the upload node.
+
+    Returns:
+        tuple: (data reference or None, True/False, or None if the check could not be done).
+    """
+    try:
+        data_reference = await manifest_data_reference(bee_api_url(swarm_ul_server[0]), reference)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as exc:
+        logging.warning(f"Could not read the manifest of {reference}: {exc}")
+        return None, None
+    if ul_redundancy:
+        # Erasure coding adds parity chunks we do not compute; just report the data root
+        return data_reference, None
+    from swarm_bmt import swarm_reference
+    expected = await asyncio.to_thread(swarm_reference, random_payload(size_kb, seed))
+    return data_reference, data_reference == expected
+
+async def upload_swarm_replicate(size_kb, ul_redundancy, replicate, seed):
+    """Uploads one random file, generated from `seed`, to Swarm.
+
+    Args:
+        size_kb (int): File size in kilobytes.
+        ul_redundancy (int): Erasure coding level.
+        replicate (int): Replicate number, stored in the references entry.
+        seed (int): Seed of the payload generator.
+
+    Returns:
+        tuple: (SHA256 hex digest of the payload, references entry or None if the upload failed).
+    """
+    sha256 = hashlib.sha256()
+
+    start_upload_time = time.time()
+    status, response_data, upload_details = await upload_file(random_payload(size_kb, seed, sha256), size_kb * 1024, swarm_ul_server, ul_redundancy)
+    # Generating and hashing the payload is not part of the upload, as before it was streamed
+    upload_duration = time.time() - start_upload_time - upload_details["upload_phases"]["generate"]
+    # Taken before --verify-upload hashes the file, since the sync wait counts from here
+    uploaded_at = datetime.datetime.now(pytz.utc).isoformat()
+    sha256_hash = sha256.hexdigest()
+    logging.info(f'Generated {size_kb}kb file from seed {seed}. SHA256 hash of upload: {sha256_hash}')
+
+    if not 200 <= status < 300:
+        logging.info(f'Error: Failed to upload: {status}')
+        return sha256_hash, None
+
+    response_file_swarmhash = response_data.get("reference", "")
+    logging.info(f'Successfully uploaded file. Swarmhash: {response_file_swarmhash}')
+    logging.info(f'https://download.gateway.ethswarm.org/bzz/{response_file_swarmhash}')
+    logging.info(f'Upload to swarm duration: {upload_duration}')
+
+    if args.verify_upload:
+        data_reference, verified = await verify_upload(response_file_swarmhash, size_kb, ul_redundancy, seed)
+        upload_details = dict(upload_details, data_reference=data_reference, verified=verified)
+        if verified is False:
+            logging.error(f'Upload {response_file_swarmhash} holds data {data_reference}, not the generated file; dropping it')
+            return sha256_hash, None
+        logging.info(f'Upload verified: {verified}, data reference {data_reference}')
+
+    return sha256_hash, {
+        "hash": response_file_swarmhash,
+        "sha256": sha256_hash,
+        "seed": seed,
+        "upload_time": upload_duration,
+        "timestamp": uploaded_at,
+        "ul_redundancy": ul_redundancy,
+        "replicate": replicate,
+        **upload_details
+    }
+
+PROBE_MAX_INTERVAL = 300
+
+def server_url(server):
+    """Base URL of a Bee API server given as host[:port], defaulting to http."""
+    return server if server.startswith(('http://', 'https://')) else f'http://{server}'
 
-    response = requests.post(url=url, data=data, headers=headers, timeout=10000, stream=True)
-    return response
+async def is_retrievable(reference, server, method):
+    """Asks a Bee node whether `reference` can be retrieved from the network.
+
+    Args:
+        reference (str): The Swarm reference.
+        server (str): The probe node. It should not be one of the download
+            servers, because probing fetches chunks and may cache them there.
+        method (str): "stewardship" checks every chunk through /stewardship;
+            "chunk" only fetches the root chunk through /chunks.
+
+    Returns:
+        bool: True if the node reports the data retrievable.
+    """
+    timeout = aiohttp.ClientTimeout(total=120)
+    try:
+        if method == 'stewardship':
+            async with http_session.get(f'{server_url(server)}/stewardship/{reference}', timeout=timeout) as response:
+                return response.status == 200 and (await response.json()).get("isRetrievable", False)
+        async with http_session.get(f'{server_url(server)}/chunks/{reference}', timeout=timeout) as response:
+            await response.read()
+            return response.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as exc:
+        logging.debug(f"Probe of {reference} on {server} failed: {exc}")
+        return False
+
+async def wait_until_retrievable(reference, uploaded_at, server, method, max_wait, interval):
+    """Polls a probe node with exponential backoff until `reference` is retrievable.
+
+    Args:
+        reference (str): The Swarm reference.
+        uploaded_at (float): Upload time as a Unix timestamp.
+        server (str): The probe node.
+        method (str): Probe method, see `is_retrievable`.
+        max_wait (float): Give up this many seconds after the upload.
+        interval (float): First delay between probes; doubled after every miss,
+            up to PROBE_MAX_INTERVAL.
+
+    Returns:
+        float: Seconds from upload until the data was confirmed retrievable, or
+        None if `max_wait` passed first.
+    """
+    delay = interval
+    while True:
+        if await is_retrievable(reference, server, method):
+            return time.time() - uploaded_at
+        remaining = uploaded_at + max_wait - time.time()
+        if remaining <= 0:
+            logging.warning(f"{reference} not confirmed retrievable within {max_wait}s, downloading anyway")
+            return None
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, PROBE_MAX_INTERVAL)
+
+def sync_waiter(args):
+    """Returns a function that waits until a references entry may be downloaded.
+
+    With `--sync-wait probe` each reference is probed once, however many servers
+    download it, and released as soon as it is confirmed retrievable; the
+    function then returns the measured time-to-retrievable. With `--sync-wait
+    fixed` it returns at once (the fixed delay is applied elsewhere).
+    """
+    probes = {}
+
+    def wait(entry, size):
+        if args.sync_wait != 'probe':
+            return None
+        if entry["hash"] not in probes:
+            uploaded_at = datetime.datetime.fromisoformat(entry["timestamp"]).timestamp()
+
+            async def probe():
+                seconds = await wait_until_retrievable(entry["hash"], uploaded_at, args.probe_server, args.probe_method,
+                                                       args.probe_max_wait, args.probe_interval)
+                if seconds is not None:
+                    logging.info(f"{entry['hash']} retrievable {seconds:.0f}s after upload")
+                    TIME_TO_RETRIEVABLE.labels(storage='Swarm', size=size, ul_redundancy=entry.get("ul_redundancy")).observe(seconds)
+                return seconds
+
+            probes[entry["hash"]] = asyncio.ensure_future(probe())
+        return probes[entry["hash"]]
+
+    return wait
 
 async def pin_json_to_ipfs(jwt, json_data, filename):
     """Pins JSON data to IPFS using Pinata's API.
@@ -506,15 +1830,14 @@ async def pin_json_to_ipfs(jwt, json_data, filename):
         'pinataMetadata': {'name': filename}
     }
 
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(url, json=payload, headers=headers) as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    logging.error(f'Error pinning to Pinata: {response.status} - {await response.text()}')
-        except aiohttp.ClientError as e:
-            logging.error(f'Error pinning to Pinata: {e}')
+    try:
+        async with http_session.post(url, json=payload, headers=headers) as response:
+            if response.status == 200:
+                return await response.json()
+            else:
+                logging.error(f'Error pinning to Pinata: {response.status} - {await response.text()}')
+    except aiohttp.ClientError as e:
+        logging.error(f'Error pinning to Pinata: {e}')
 
     return None
 
@@ -554,18 +1877,55 @@ async def pin_file_to_ipfs(jwt, file_path, filename, file_type="application/octe
         }
         form_data.add_field('pinataOptions', json.dumps(pinata_options))
 
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, data=form_data, headers=headers) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    else:
-                        logging.error(f'Error pinning file to Pinata: {response.status} - {await response.text()}')
-            except aiohttp.ClientError as e:
-                logging.error(f'Error pinning file to Pinata: {e}')
+        try:
+            async with http_session.post(url, data=form_data, headers=headers) as response:
+                if response.status == 200:
+                    return await response.json()
+                else:
+                    logging.error(f'Error pinning file to Pinata: {response.status} - {await response.text()}')
+        except aiohttp.ClientError as e:
+            logging.error(f'Error pinning file to Pinata: {e}')
 
     return None
 
+class ConcurrencyLimits:
+    """A global and a per-server limit on work in flight, shareable between batches.
+
+    A task first waits for a slot on its server and only then for a global
+    slot, so a busy server never holds global slots that other servers could use.
+    """
+
+    def __init__(self, concurrency, server_concurrency):
+        self.global_slots = asyncio.Semaphore(max(1, concurrency))
+        self.server_concurrency = max(1, server_concurrency)
+        self.server_slots = {}
+
+    @contextlib.asynccontextmanager
+    async def slot(self, server):
+        slots = self.server_slots.setdefault(server, asyncio.Semaphore(self.server_concurrency))
+        async with slots:
+            async with self.global_slots:
+                yield
+
+async def run_bounded(tasks, limits):
+    """Runs coroutines within the given concurrency limits.
+
+    Args:
+        tasks (list): A list of (server, coroutine) tuples. A task may carry a third
+            element, an awaitable that must finish before the task takes a slot.
+        limits (ConcurrencyLimits): The limits to respect.
+
+    Returns:
+        list: The results in the order of `tasks`; exceptions are returned, not raised.
+    """
+    async def run(server, coro, ready=None):
+        if ready is not None:
+            await ready
+        async with limits.slot(server):
+            return await coro
+
+    return await asyncio.gather(*(run(*task) for task in tasks), return_exceptions=True)
+
 async def get_random_ip_from_servers(servers, username):
     server_user_ips = {}
     tasks = [get_random_ip_from_server(server, username) for server in servers]
@@ -576,16 +1936,804 @@ async def get_random_ip_from_servers(servers, username):
 
     return server_user_ips
 
+class AdaptiveReplicates:
+    """Decides how many replicates each campaign cell gets, from the spread of its download times.
+
+    Download times are tracked per cell and server as running statistics of their
+    logarithm, so the half-width of a confidence interval for the mean is a relative
+    error (0.05 is about +-5%), comparable across file sizes. A cell needs more
+    replicates while its widest server interval is above `ci_target`. Cells are
+    topped up in rounds; a round gives each unfinished cell at most `batch` more
+    replicates, widest intervals first, until `budget` replicates are used up.
+    """
+
+    def __init__(self, min_replicates, max_replicates, ci_target, batch, budget, confidence=0.95):
+        self.min_replicates = min_replicates
+        self.max_replicates = max_replicates
+        self.ci_target = ci_target
+        self.batch = batch
+        self.budget = budget
+        self.z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+        self.stats = {}  # (cell key, server) -> [count, mean, sum of squared deviations] of log seconds
+        self.planned = {}  # cell key -> replicates uploaded or being uploaded
+
+    @staticmethod
+    def key(cell):
+        return (cell["size"], cell["ul_redundancy"], cell["dl_redundancy"])
+
+    def add(self, cell, server, seconds):
+        """Adds the time of one successful download (Welford's update)."""
+        stats = self.stats.setdefault((self.key(cell), server), [0, 0.0, 0.0])
+        value = math.log(max(seconds, 1e-6))
+        stats[0] += 1
+        delta = value - stats[1]
+        stats[1] += delta / stats[0]
+        stats[2] += delta * (value - stats[1])
+
+    def half_width(self, cell):
+        """Relative half-width of the widest server interval of `cell`; infinite below two downloads."""
+        widths = [self.z * math.sqrt(m2 / (count - 1) / count) if count > 1 else math.inf
+                  for (key, _), (count, _, m2) in self.stats.items() if key == self.key(cell)]
+        return max(widths, default=math.inf)
+
+    def needed(self, cell):
+        """Replicates `cell` still needs to reach the target, projected from its current spread, capped at `batch`."""
+        planned = self.planned.get(self.key(cell), 0)
+        width = self.half_width(cell)
+        if width <= self.ci_target or planned >= self.max_replicates:
+            return 0
+        projected = math.ceil(planned * (width / self.ci_target) ** 2) if math.isfinite(width) else planned + self.batch
+        return max(1, min(projected - planned, self.batch, self.max_replicates - planned))
+
+    def allocate(self, cells):
+        """
+        Hands out the next round of replicates.
+
+        Args:
+            cells (list): The cells still open.
+
+        Returns:
+            dict: Cell key -> number of replicates to add; cells left out are finished.
+        """
+        remaining = self.budget - sum(self.planned.values())
+        extra = {}
+        for cell in sorted(cells, key=self.half_width, reverse=True):
+            grant = min(self.needed(cell), remaining)
+            if grant > 0:
+                extra[self.key(cell)] = grant
+                remaining -= grant
+        return extra
+
+def expand_design(design):
+    """Expands a campaign design into its cells, in the order they are run.
+
+    Every erasure level is combined with the retrieval strategies listed for it
+    under "strategies" (falling back to the "default" entry), and every such pair
+    with every size.
+
+    Args:
+        design (dict): The design spec, see campaign.json.example.
+
+    Returns:
+        list: Cells as {"phase": "cell", "size", "ul_redundancy", "dl_redundancy"} dicts,
+        the same shape `run_cell` gives for a single invocation.
+    """
+    strategies = design.get("strategies", {})
+    cells = []
+    for ul_redundancy in design["erasure"]:
+        for dl_redundancy in strategies.get(str(ul_redundancy), strategies.get("default", [0])):
+            for size in design["sizes"]:
+                cells.append({"phase": "cell", "size": str(size), "ul_redundancy": ul_redundancy, "dl_redundancy": dl_redundancy})
+    return cells
+
+async def run_campaign(args):
+    """Runs a whole factorial campaign in one process.
+
+    Cells are uploaded one after the other. Instead of idling through the sync
+    delay, the next cell is uploaded while earlier ones wait; each reference is
+    downloaded from every server once its own delay has passed. Downloads of all
+    cells share one set of concurrency limits. Progress goes to the state file,
+    so an interrupted campaign continues with `--resume`. Without it the campaign
+    starts over. State cells and references files carry the campaign name, so
+    campaigns sharing the state file and `--references-dir` do not collide.
+
+    With an "adaptive" section in the design, cells start with its `min_replicates`
+    and are then topped up in rounds by `AdaptiveReplicates` until their download
+    times are known precisely enough.
+    """
+    with open(args.design, 'r') as f:
+        design = json.load(f)
+    name = design.get("name", Path(args.design).stem)
+    servers = design.get("servers", swarm_dl_servers)
+    replicates = design.get("replicates", args.repeat)
+    sync_delay = design.get("sync_delay", 900)
+    dl_retrieval = design.get("dl_retrieval", args.dl_retrieval)
+
+    state = CampaignState(args.state_file, resume=args.resume)
+    results_log = open_results_log(results_file_onlyswarm)
+    run_timestamp = datetime.datetime.now(pytz.utc).isoformat()
+    synced = sync_waiter(args)
+    download_limits = ConcurrencyLimits(args.dl_concurrency, args.dl_server_concurrency)
+    cells = expand_design(design)
+
+    allocator = None
+    if "adaptive" in design:
+        adaptive = design["adaptive"]
+        allocator = AdaptiveReplicates(adaptive.get("min_replicates", 10), adaptive.get("max_replicates", 2 * replicates),
+                                       adaptive.get("ci_target", 0.05), adaptive.get("batch", 5),
+                                       adaptive.get("budget", replicates * len(cells)), adaptive.get("confidence", 0.95))
+        # Downloads of an interrupted run still count towards the statistics
+        for record in read_json_lines(results_file_onlyswarm + 'l') if args.resume else []:
+            result = record["result"]
+            if result.get("campaign") == name and result["sha256_match"] == 'true':
+                cell = {"size": result["size"], "ul_redundancy": result["ul_redundancy"], "dl_redundancy": result["dl_redundancy"]}
+                allocator.add(cell, result["ip"], result["download_time_seconds"])
+        logging.info(f'Campaign {name}: {len(cells)} cells x {allocator.min_replicates}-{allocator.max_replicates} replicates '
+                     f'(budget {allocator.budget}, target +-{allocator.ci_target:.0%}) x {len(servers)} servers')
+    else:
+        logging.info(f'Campaign {name}: {len(cells)} cells x {replicates} replicates x {len(servers)} servers')
+
+    def state_cell(cell):
+        return {"campaign": name, **cell}
+
+    async def download_when_synced(cell, entry, server):
+        size, ul_redundancy, dl_redundancy = cell["size"], cell["ul_redundancy"], cell["dl_redundancy"]
+        download = {"phase": "download", "campaign": name, "storage": "swarm", "size": size, "ul_redundancy": ul_redundancy,
+                    "dl_redundancy": dl_redundancy, "replicate": entry["replicate"], "server": server, "round": 0}
+        if state.is_done(download):
+            return
+        uploaded_at = datetime.datetime.fromisoformat(entry["timestamp"]).timestamp()
+        ready = synced(entry, size)
+        if ready is not None:
+            time_to_retrievable = await ready
+        else:
+            time_to_retrievable = None
+            await asyncio.sleep(max(0, uploaded_at + sync_delay - time.time()))
+        async with download_limits.slot(server):
+            wait_seconds = time.time() - uploaded_at
+            result = await get_backend("swarm").download(server, entry["hash"], entry["sha256"], 15, size, ul_redundancy,
+                                                         dl_redundancy=dl_redundancy, dl_retrieval=dl_retrieval)
+        tags = {"campaign": name, "cell_replicate": entry["replicate"], "wait_seconds": wait_seconds,
+                "time_to_retrievable": time_to_retrievable}
+        record_download(result, results_log, run_timestamp, dl_redundancy, dl_retrieval, tags)
+        state.mark_done(download)
+        observe_download(result, dl_redundancy, dl_retrieval)
+        if allocator is not None and result[1] == 'true':
+            allocator.add(cell, server, result[0])
+
+    async def download_cell(cell, entries):
+        tasks = [download_when_synced(cell, entry, server) for entry in entries for server in servers]
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                logging.error(f'Download failed in cell {cell}: {str(result)}')
+        metrics_exporter.mark_dirty()
+        if allocator is None:
+            state.mark_done(state_cell(cell))
+            logging.info(f'Cell done: {cell}')
+
+    def references_file_of(cell):
+        # One references file per campaign and cell; with --resume, entries already in it are not uploaded again.
+        return os.path.join(args.references_dir, f'references_onlyswarm_{name}_{cell["ul_redundancy"]}_{cell["dl_redundancy"]}_{cell["size"]}kb.json')
+
+    cell_references = {}
+
+    async def upload_cell(cell, count):
+        """Uploads the replicates of `cell` it is missing up to `count` and returns the task downloading them."""
+        size, ul_redundancy = cell["size"], cell["ul_redundancy"]
+        cell_references_file = references_file_of(cell)
+        os.makedirs(args.references_dir, exist_ok=True)
+        if cell_references_file not in cell_references:
+            if not args.resume and os.path.exists(cell_references_file + 'l'):
+                os.remove(cell_references_file + 'l')  # journal of an earlier run that is not resumed
+            cell_references[cell_references_file] = (load_references(cell_references_file) if args.resume else None) or {"swarm": {}}
+        references = cell_references[cell_references_file]
+        entries = references.setdefault("swarm", {}).setdefault(size, [])
+        uploaded = {entry["replicate"] for entry in entries}
+        count = max(count, max(uploaded, default=-1) + 1)
+        if allocator is not None:
+            allocator.planned[allocator.key(cell)] = count
+
+        with JsonLinesLog(cell_references_file + 'l', fsync_every=1) as journal:
+            async def upload(r):
+                entry = await get_backend("swarm").upload(int(size), new_payload_seed(), r, ul_redundancy)
+                if entry:
+                    entries.append(entry)
+                    journal.append({"storage": "swarm", "size": size, "entry": entry})
+
+            upload_tasks = [(swarm_ul_server[0], upload(r)) for r in range(count) if r not in uploaded]
+            for result in await run_bounded(upload_tasks, ConcurrencyLimits(args.ul_concurrency, args.ul_concurrency)):
+                if isinstance(result, Exception):
+                    logging.error(f'Upload failed in cell {cell}: {str(result)}')
+        compact_references(references, cell_references_file)
+
+        return asyncio.create_task(download_cell(cell, list(entries)))
+
+    downloads = []
+    for cell in cells:
+        if state.is_done(state_cell(cell)):
+            logging.info(f'Cell {cell} is already done, skipping')
+            if allocator is not None:
+                # Its replicates still count against the budget
+                references = load_references(references_file_of(cell)) or {}
+                allocator.planned[allocator.key(cell)] = len(references.get("swarm", {}).get(cell["size"], []))
+            continue
+        downloads.append(await upload_cell(cell, allocator.min_replicates if allocator else replicates))
+    await asyncio.gather(*downloads)
+
+    while allocator is not None:
+        open_cells = [cell for cell in cells if not state.is_done(state_cell(cell))]
+        extra = allocator.allocate(open_cells)
+        for cell in open_cells:
+            if allocator.key(cell) not in extra:
+                state.mark_done(state_cell(cell))
+                logging.info(f'Cell done with {allocator.planned.get(allocator.key(cell), 0)} replicates, '
+                             f'+-{allocator.half_width(cell):.1%}: {cell}')
+        if not extra:
+            break
+        logging.info(f'Adding {sum(extra.values())} replicates to {len(extra)} cells')
+        downloads = []
+        for cell in open_cells:
+            key = allocator.key(cell)
+            if key in extra:
+                downloads.append(await upload_cell(cell, allocator.planned[key] + extra[key]))
+        await asyncio.gather(*downloads)
+
+    results_log.close()
+    export_results(results_file_onlyswarm)
+    state.close()
+    logging.info(f'Campaign {name} done')
+
+def load_levels(spec):
+    """Parses `--load-levels`: a list like "1,2,8,16", or a single maximum N for 1, 2, 4, ... N."""
+    levels = [int(level) for level in spec.split(',')]
+    if len(levels) == 1:
+        levels = [1 << i for i in range(levels[0].bit_length()) if 1 << i < levels[0]] + levels
+    return levels
+
+def find_knee(steps, min_gain, max_latency_factor, max_error_rate):
+    """
+    Finds the highest concurrency level that still paid off.
+
+    Walking up the levels, a step ends the sweep when its error rate is above
+    `max_error_rate`, its p95 latency is more than `max_latency_factor` times the p95
+    at the lowest level, or its throughput gained less than `min_gain` (a fraction)
+    over the previous level. The knee is the last step before that.
+
+    Args:
+        steps (list): Step reports of `run_loadtest`, ordered by level.
+
+    Returns:
+        dict: The step at the knee, or None if even the lowest level failed.
+    """
+    knee = None
+    for step in steps:
+        if step["error_rate"] > max_error_rate:
+            break
+        if knee is not None:
+            if step["p95"] > max_latency_factor * steps[0]["p95"]:
+                break
+            if step["files_per_second"] < knee["files_per_second"] * (1 + min_gain):
+                break
+        knee = step
+    return knee
+
+async def run_loadtest(args):
+    """
+    Steps the number of concurrent downloads (or uploads) against one Bee node.
+
+    Each level keeps that many requests in flight for `--step-duration` seconds;
+    downloads cycle through the Swarm references in `--load-references`, uploads
+    send fresh random files of `--size` kb. Every step's throughput, latency
+    percentiles and error rate go to `--load-results` and to the metrics, and the
+    knee of the curve is reported at the end.
+    """
+    op = args.load_op
+    server = args.load_server or (swarm_dl_servers[0] if op == 'download' else swarm_ul_server[0])
+    levels = load_levels(args.load_levels)
+
+    if op == 'download':
+        references = load_references(args.load_references) or {}
+        pool = [(size, entry) for size, entries in references.get("swarm", {}).items() for entry in entries]
+        if not pool:
+            logging.error(f"No Swarm references in {args.load_references} to download")
+            return
+        await get_ipinfo(await resolve_host(extract_port(server)[0]))
+    if (op == 'upload' or args.connection == 'warm') and max(levels) > args.conn_limit_per_host:
+        logging.warning(f"--conn-limit-per-host {args.conn_limit_per_host} caps levels above it")
+
+    requests_sent = 0
+
+    async def one_request():
+        """Returns (success, bytes) of one request."""
+        nonlocal requests_sent
+        requests_sent += 1
+        if op == 'download':
+            size, entry = pool[requests_sent % len(pool)]
+            result = await get_backend("swarm").download(server, entry["hash"], entry["sha256"], 1, size, entry["ul_redundancy"])
+            return result[1] == 'true', int(size) * 1024
+        status, response_data, _ = await upload_file(random_payload(args.size, new_payload_seed()), args.size * 1024, [server])
+        return status == 201 and "reference" in response_data, args.size * 1024
+
+    steps = []
+    with JsonLinesLog(args.load_results) as log:
+        for level in levels:
+            latencies = []
+            errors = 0
+            transferred = 0
+            deadline = time.monotonic() + args.step_duration
+
+            async def worker():
+                nonlocal errors, transferred
+                while time.monotonic() < deadline:
+                    start = time.perf_counter()
+                    try:
+                        ok, size_in_bytes = await one_request()
+                    except Exception as exc:
+                        logging.debug(f"Load test request failed: {exc}")
+                        ok = False
+                    if ok:
+                        latencies.append(time.perf_counter() - start)
+                        transferred += size_in_bytes
+                    else:
+                        errors += 1
+
+            start = time.monotonic()
+            await asyncio.gather(*(worker() for _ in range(level)))
+            duration = time.monotonic() - start
+            total = len(latencies) + errors
+            step = {
+                "type": "step",
+                "timestamp": datetime.datetime.now(pytz.utc).isoformat(),
+                "op": op,
+                "server": server,
+                "concurrency": level,
+                "requests": total,
+                "errors": errors,
+                "error_rate": errors / total if total else 1.0,
+                "duration": duration,
+                "files_per_second": len(latencies) / duration,
+                "mb_per_second": transferred / duration / 1e6,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+            }
+            steps.append(step)
+            log.append(step)
+            for stat in ("files_per_second", "mb_per_second", "error_rate", "p50", "p95", "p99"):
+                if step[stat] is not None:
+                    LOAD_STEP.labels(op=op, server=server, concurrency=level, stat=stat).set(step[stat])
+            metrics_exporter.mark_dirty()
+            p95 = f"{step['p95']:.3f}s" if step['p95'] is not None else "n/a"
+            logging.info(f"Concurrency {level}: {step['files_per_second']:.2f} files/s, {step['mb_per_second']:.2f} MB/s, "
+                         f"p95 {p95}, errors {step['error_rate']:.1%}")
+            if step["error_rate"] >= 1.0:
+                logging.warning("Every request failed, stopping the sweep")
+                break
+
+        knee = find_knee(steps, args.knee_gain, args.knee_latency, args.max_error_rate)
+        log.append({"type": "knee", "op": op, "server": server, "concurrency": knee["concurrency"] if knee else None})
+    if knee:
+        logging.info(f"Knee at concurrency {knee['concurrency']}: {knee['files_per_second']:.2f} files/s, p95 {knee['p95']:.3f}s")
+    else:
+        logging.info("No knee found: even the lowest level failed the criteria")
+
+async def walk_chunk_tree(api_url, reference, concurrency):
+    """
+    Fetches every data chunk of a file through /chunks, timing each one.
+
+    Children are requested as soon as their parent arrives, so the walk follows
+    the tree the way a download does. Parity chunks of erasure-coded files are
+    skipped, as a plain download would skip them. Chunk addresses are checked in
+    one batch after the walk, so hashing does not add to the times measured.
+
+    Args:
+        api_url (str): Base URL of the Bee API.
+        reference (str): The data reference of the file (not its manifest).
+        concurrency (int): Chunks fetched at the same time.
+
+    Returns:
+        tuple: (chunks, wall time of the walk). `chunks` has one dict per chunk with
+        its depth, latency, and `path`: the summed latency of the chunks above it and
+        itself, i.e. its place on the critical path.
+
+    Raises:
+        ValueError: If a chunk does not match its address.
+    """
+    from swarm_bmt import chunk_addresses_of, data_children
+    slots = asyncio.Semaphore(max(1, concurrency))
+    chunks = []
+    fetched = []
+
+    async def visit(chunk_reference, depth, path):
+        async with slots:
+            start = time.perf_counter()
+            async with http_session.get(f'{api_url}/chunks/{chunk_reference}', timeout=aiohttp.ClientTimeout(total=120)) as response:
+                response.raise_for_status()
+                chunk = await response.read()
+            latency = time.perf_counter() - start
+        fetched.append((chunk_reference, chunk))
+        chunks.append({"depth": depth, "latency": latency, "path": path + latency})
+        await asyncio.gather(*(visit(child, depth + 1, path + latency) for child, _ in data_children(chunk)))
+
+    start = time.perf_counter()
+    await visit(reference, 0, 0.0)
+    walk_time = time.perf_counter() - start
+    addresses = await asyncio.to_thread(chunk_addresses_of, [chunk for _, chunk in fetched])
+    for (chunk_reference, _), address in zip(fetched, addresses):
+        if address.hex() != chunk_reference:
+            raise ValueError(f"Chunk {chunk_reference} does not match its address")
+    return chunks, walk_time
+
+async def timed_bytes_download(api_url, reference, expected_sha256):
+    """Downloads a file through /bytes and returns (seconds, True if the SHA256 matches)."""
+    trace = {}
+    start = time.perf_counter()
+    async with http_session.get(f'{api_url}/bytes/{reference}', headers=DOWNLOAD_HEADERS, trace_request_ctx=trace, auto_decompress=False,
+                                timeout=aiohttp.ClientTimeout(total=10000)) as response:
+        sha256 = await stream_body(response, trace) if response.status == 200 else None
+    return time.perf_counter() - start, sha256 == expected_sha256
+
+async def run_chunks(args):
+    """
+    Times Swarm retrieval chunk by chunk, next to whole-file assembly.
+
+    For every stored Swarm reference and download server, the file's chunk tree
+    is walked through /chunks with bounded concurrency, which gives the latency
+    of every chunk and the slowest root-to-leaf path. The file is then downloaded
+    whole through /bytes; its chunks are now on the node, so that time is mostly
+    assembly and transfer. Both go to `--chunk-results`.
+    """
+    references = load_references(references_file_onlyswarm if args.only_swarm else references_file) or {}
+    with JsonLinesLog(args.chunk_results) as log:
+        for size, entries in references.get("swarm", {}).items():
+            for entry in entries:
+                async def measure(server):
+                    api_url = server_url(server)
+                    data_reference = entry.get("data_reference") or await manifest_data_reference(api_url, entry["hash"])
+                    if data_reference is None:
+                        raise ValueError("manifest has no index document")
+                    chunks, walk_time = await walk_chunk_tree(api_url, data_reference, args.chunk_concurrency)
+                    file_time, verified = await timed_bytes_download(api_url, data_reference, entry["sha256"])
+
+                    latencies = [chunk["latency"] for chunk in chunks]
+                    record = {
+                        "timestamp": datetime.datetime.now(pytz.utc).isoformat(),
+                        "server": server,
+                        "size": size,
+                        "ul_redundancy": entry.get("ul_redundancy", 0),
+                        "hash": entry["hash"],
+                        "data_reference": data_reference,
+                        "chunks": len(chunks),
+                        "depth": max(chunk["depth"] for chunk in chunks),
+                        "walk_time": walk_time,
+                        "critical_path": max(chunk["path"] for chunk in chunks),
+                        "slowest_chunk": max(latencies),
+                        "sum_chunk_time": sum(latencies),
+                        "p50": percentile(latencies, 50),
+                        "p95": percentile(latencies, 95),
+                        "p99": percentile(latencies, 99),
+                        "file_time_after_walk": file_time,
+                        "file_verified": verified,
+                        "chunk_latencies": [[chunk["depth"], chunk["latency"]] for chunk in chunks],
+                    }
+                    for chunk in chunks:
+                        CHUNK_TIME.labels(server=server, size=size, depth=chunk["depth"]).observe(chunk["latency"])
+                    logging.info(f"{server} {size}kb {entry['hash'][:16]}: {len(chunks)} chunks, walk {walk_time:.3f}s, "
+                                 f"critical path {record['critical_path']:.3f}s, slowest chunk {record['slowest_chunk']:.3f}s, "
+                                 f"p95 {record['p95']:.3f}s, whole file after walk {file_time:.3f}s")
+                    return record
+
+                for server, record in zip(swarm_dl_servers, await asyncio.gather(*(measure(server) for server in swarm_dl_servers), return_exceptions=True)):
+                    if isinstance(record, Exception):
+                        logging.error(f"Chunk walk of {entry['hash']} on {server} failed: {record}")
+                    else:
+                        log.append(record)
+                metrics_exporter.mark_dirty()
+
+def payload_ranges_sha256(size_kb, seed, ranges):
+    """
+    Computes the SHA256 of byte ranges of a payload regenerated from its seed.
+
+    The payload is generated once, a buffer at a time, and every range is hashed
+    as its bytes go by, so memory stays at one buffer whatever the number of ranges.
+
+    Args:
+        size_kb (int): Size of the payload in kilobytes.
+        seed (int): Seed the payload was generated from.
+        ranges (list): (offset, length) pairs.
+
+    Returns:
+        list: The SHA256 hex digest of every range, in the order given.
+    """
+    digests = [hashlib.sha256() for _ in ranges]
+    position = 0
+    for chunk in random_payload(size_kb, seed):
+        end = position + len(chunk)
+        for (offset, length), digest in zip(ranges, digests):
+            if offset < end and offset + length > position:
+                digest.update(chunk[max(offset - position, 0):min(offset + length - position, len(chunk))])
+        position = end
+    return [digest.hexdigest() for digest in digests]
+
+def range_plan(size_bytes, offsets, lengths, reads, rng):
+    """
+    Lists the (offset, length) reads to make into one file.
+
+    Args:
+        size_bytes (int): Size of the file.
+        offsets (str): "random", or comma-separated byte offsets.
+        lengths (list): Read lengths in bytes; lengths larger than the file are left out.
+        reads (int): Reads per length at random offsets.
+        rng (random.Random): Source of the random offsets.
+
+    Returns:
+        list: (offset, length) pairs, each read lying inside the file.
+    """
+    plan = []
+    for length in lengths:
+        if length > size_bytes:
+            continue
+        if offsets == 'random':
+            plan.extend((rng.randrange(size_bytes - length + 1), length) for _ in range(reads))
+        else:
+            plan.extend((int(offset), length) for offset in offsets.split(',') if int(offset) + length <= size_bytes)
+    return plan
+
+async def range_read(session, url, offset, length, expected_sha256):
+    """
+    Reads `length` bytes at `offset` of a file with an HTTP Range request.
+
+    Returns:
+        dict: status, `ttfb` (request start until the first body byte), `total`
+        (until the last byte), bytes received and whether they match `expected_sha256`
+        (None if unknown). A server that ignores the Range header and answers 200
+        is not read further; its result has `partial` False.
+    """
+    headers = {"Range": f"bytes={offset}-{offset + length - 1}", "Accept-Encoding": "identity"}
+    result = {"offset": offset, "length": length, "status": None, "ttfb": None, "total": None, "bytes": 0, "partial": None, "verified": None}
+    sha256 = hashlib.sha256()
+    start = time.perf_counter()
+    async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=1000)) as response:
+        result["status"] = response.status
+        result["partial"] = response.status == 206
+        if response.status != 206:
+            return result
+        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+            if result["ttfb"] is None:
+                result["ttfb"] = time.perf_counter() - start
+            sha256.update(chunk)
+            result["bytes"] += len(chunk)
+    result["total"] = time.perf_counter() - start
+    if expected_sha256 is not None:
+        result["verified"] = result["bytes"] == length and sha256.hexdigest() == expected_sha256
+    return result
+
+async def run_ranges(args):
+    """
+    Measures seek latency: partial reads into stored files through /bzz and /ipfs.
+
+    Every stored reference of at least `--range-min-size` kb is read with Range
+    requests of every `--range-lengths`, at `--range-offsets`, from every download
+    server. Each request records its time to first byte and to completion; bytes
+    are checked against the payload regenerated from the seed stored with the reference.
+    """
+    references = load_references(references_file_onlyswarm if args.only_swarm else references_file) or {}
+    lengths = [int(length) for length in args.range_lengths.split(',')]
+    rng = random.Random(args.range_seed)
+    paths = {"swarm": ("Swarm", "bzz", swarm_dl_servers), "ipfs": ("Ipfs", "ipfs", [] if args.only_swarm else ipfs_dl_servers)}
+    slots = asyncio.Semaphore(max(1, args.range_concurrency))
+
+    with JsonLinesLog(args.range_results) as log:
+        for storage_key, (storage, path, servers) in paths.items():
+            for size, entries in references.get(storage_key, {}).items():
+                if int(size) < args.range_min_size:
+                    continue
+                for entry in entries:
+                    plan = range_plan(int(size) * 1024, args.range_offsets, lengths, args.range_reads, rng)
+                    expected = [None] * len(plan)
+                    if entry.get("seed") is not None:
+                        expected = await asyncio.to_thread(payload_ranges_sha256, int(size), entry["seed"], plan)
+
+                    for server in servers:
+                        url = f'{server_url(server)}/{path}/{entry["hash"]}'
+
+                        async def read(offset, length, expected_sha256):
+                            async with slots:
+                                try:
+                                    result = await range_read(session, url, offset, length, expected_sha256)
+                                except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                                    result = {"offset": offset, "length": length, "status": None, "ttfb": None, "total": None,
+                                              "bytes": 0, "partial": None, "verified": None, "error": str(exc)}
+                            return result
+
+                        async with download_session() as session:
+                            results = await asyncio.gather(*(read(offset, length, expected_sha256) for (offset, length), expected_sha256 in zip(plan, expected)))
+
+                        for result in results:
+                            log.append({
+                                "timestamp": datetime.datetime.now(pytz.utc).isoformat(),
+                                "storage": storage,
+                                "server": server,
+                                "size": size,
+                                "hash": entry["hash"],
+                                "connection": args.connection,
+                                **result
+                            })
+                            if result["total"] is not None:
+                                RANGE_TIME.labels(storage=storage, server=server, length=result["length"], stat='ttfb').observe(result["ttfb"] or result["total"])
+                                RANGE_TIME.labels(storage=storage, server=server, length=result["length"], stat='total').observe(result["total"])
+                        for length in lengths:
+                            done = [result for result in results if result["length"] == length and result["total"] is not None]
+                            if done:
+                                logging.info(f"{storage} {server} {size}kb {entry['hash'][:16]} {length}B x{len(done)}: "
+                                             f"ttfb p50 {percentile([result['ttfb'] or result['total'] for result in done], 50):.3f}s, "
+                                             f"total p50 {percentile([result['total'] for result in done], 50):.3f}s, "
+                                             f"p95 {percentile([result['total'] for result in done], 95):.3f}s, "
+                                             f"{sum(result['verified'] is False for result in done)} mismatched")
+                            failed = sum(result["length"] == length and result["total"] is None for result in results)
+                            if failed:
+                                logging.warning(f"{storage} {server} {size}kb {length}B: {failed} reads failed or were not served as ranges")
+                        metrics_exporter.mark_dirty()
+
+def worker_command(args):
+    """Returns the command line that starts a download worker with our download options."""
+    command = f"{args.worker_command} worker --dl-concurrency {args.dl_concurrency} --dl-server-concurrency {args.dl_server_concurrency} --connection {args.connection}"
+    if args.retry_backoff:
+        command += f" --retry-backoff {args.retry_backoff} --retry-backoff-max {args.retry_backoff_max}"
+    if args.hedge_percentile:
+        command += f" --hedge-percentile {args.hedge_percentile}"
+        if args.hedge_after is not None:
+            command += f" --hedge-after {args.hedge_after}"
+    return command
+
+async def remote_result(host, data):
+    """
+    Rebuilds a download result tuple sent by the worker on `host`.
+
+    A worker usually downloads from the Bee node on its own host; such loopback
+    servers are reported under the address and location of the worker host.
+    The `ip` field becomes "host/url", the same name the state cells use, since
+    URLs like localhost:1633 repeat across workers; the URL the worker used is
+    kept as `worker_server`.
+    """
+    data[2] = ipinfo_details(data[2]) if data[2] else None
+    worker_server = data[4]
+    data[4] = f"{host}/{worker_server}"
+    data[10] = dict(data[10] or {}, worker_server=worker_server)
+    if data[3] and extract_port(data[3])[0] in ('127.0.0.1', 'localhost'):
+        data[3] = await resolve_host(host) or host
+        data[2] = await get_ipinfo(data[3])
+    return tuple(data)
+
+async def run_remote_downloads(host, work, on_result):
+    """
+    Has a worker on `host` run downloads and collects its results.
+
+    The worker is `app.py worker`, started over SSH. Every work item is written to
+    its stdin once its sync wait is over, and the worker streams one JSON line per
+    finished download back over the same channel.
+
+    Args:
+        host (str): The SSH host of the worker.
+        work (list): (cell, item, ready) tuples: the state cell, the work item for
+            the worker, and an awaitable that must finish before it is sent, or None.
+        on_result (callable): Called with (cell, ready, result) as each result arrives.
+
+    Returns:
+        list: The result tuples, in the order they arrived.
+    """
+    import asyncssh
+    results = []
+    async with asyncssh.connect(host, username=username) as conn:
+        async with conn.create_process(worker_command(args)) as process:
+            async def feed(n, item, ready):
+                if ready is not None:
+                    await ready
+                process.stdin.write(json.dumps(dict(item, id=n)) + '\n')
+
+            async def feed_all():
+                await asyncio.gather(*(feed(n, item, ready) for n, (cell, item, ready) in enumerate(work)))
+                process.stdin.write_eof()
+
+            async def forward_log():
+                async for line in process.stderr:
+                    logging.info(f"[{host}] {line.rstrip()}")
+
+            feeder = asyncio.create_task(feed_all())
+            log_task = asyncio.create_task(forward_log())
+            try:
+                async for line in process.stdout:
+                    record = json.loads(line)
+                    cell, item, ready = work[record["id"]]
+                    if "error" in record:
+                        logging.error(f"Worker {host} failed to download {item['hash']} from {item['server']}: {record['error']}")
+                        continue
+                    result = await remote_result(host, record["result"])
+                    on_result(cell, ready, result)
+                    results.append(result)
+            finally:
+                feeder.cancel()
+                await asyncio.gather(feeder, return_exceptions=True)
+            await process.wait()
+            await log_task
+            if process.exit_status:
+                logging.error(f"Worker on {host} exited with status {process.exit_status}")
+    return results
+
+async def run_worker(args):
+    """
+    Downloads the work items read from stdin and writes each result to stdout.
+
+    Items arrive one JSON object per line while earlier downloads are still
+    running, and every result goes out as one JSON line as soon as it is done.
+    Logging goes to stderr, which the coordinator forwards.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    limits = ConcurrencyLimits(args.dl_concurrency, args.dl_server_concurrency)
+
+    def send(record):
+        sys.stdout.write(json.dumps(record) + '\n')
+        sys.stdout.flush()
+
+    async def download(item):
+        try:
+            async with limits.slot(item["server"]):
+                result = await get_backend("swarm").download(item["server"], item["hash"], item["sha256"], 15, item["size"], item["ul_redundancy"],
+                                                             dl_redundancy=item["dl_redundancy"], dl_retrieval=item["dl_retrieval"])
+            data = list(result)
+            data[2] = data[2].all if data[2] else None
+            send({"id": item["id"], "result": data})
+        except Exception as exc:
+            send({"id": item["id"], "error": str(exc)})
+
+    tasks = []
+    async for line in reader:
+        if line.strip():
+            tasks.append(asyncio.create_task(download(json.loads(line))))
+    await asyncio.gather(*tasks)
+
 async def main(args):
+    global http_session, lookup_cache_file
+    lookup_cache_file = args.lookup_cache
+    http_session = new_http_session()
+    metrics_exporter.start(args.push_interval, args.metrics_port)
+    try:
+        if args.command == 'campaign':
+            await run_campaign(args)
+        elif args.command == 'loadtest':
+            await run_loadtest(args)
+        elif args.command == 'worker':
+            await run_worker(args)
+        elif args.command == 'chunks':
+            await run_chunks(args)
+        elif args.command == 'ranges':
+            await run_ranges(args)
+        else:
+            await run_tests(args)
+    finally:
+        await metrics_exporter.close()
+        await http_session.close()
+
+async def run_tests(args):
     global references_file, results_file, username, prometheus_gw, prometheus_pw, prometheus_user, ipfs_data_dir, swarm_ul_server, swarm_dl_servers, ipfs_ul_server, ipfs_dl_servers, arw_ul_server, arw_dl_servers
 
+    state = CampaignState(args.state_file, resume=args.resume or args.cell_done)
+    if args.cell_done:
+        sys.exit(0 if state.is_done(run_cell(args)) else 1)
+    if args.resume and state.is_done(run_cell(args)):
+        logging.info(f'Cell {run_cell(args)} is already done, nothing to resume')
+        state.close()
+        return
+
     repeat_count = args.repeat
     continuous = args.continuous
     results_by_storage = {"Swarm": [], "Ipfs": [], "Arweave": []}  # Initialize a dictionary to store results by storage
-    arw_file_manager = FileManager(gateways=arw_ul_server, wallet_path='./arw_wallet.json')
 
-    PINATA_JWT = load_pinata_credentials()
-    if not PINATA_JWT:
+    # Only the backends a run selects are loaded: Pinata credentials are needed to
+    # upload to IPFS, and nothing but Swarm is touched with --only-swarm.
+    if args.upload and not args.only_swarm and not get_backend("ipfs").jwt:
         logging.error("Pinata API Key or Secret not found. Exiting.")
         sys.exit(1)  # Exit if credentials are not found
 
@@ -593,108 +2741,92 @@ async def main(args):
         references_file = references_file_onlyswarm
         results_file = results_file_onlyswarm
 
+    if args.export_results:
+        export_results(results_file)
+        logging.info(f'Exported {results_file + "l"} to {results_file}')
+
     # Read existing references from the file
-    if os.path.exists(references_file):
-        with open(references_file, 'r') as f:
-            references = json.load(f)
-    else:
-        references = {"swarm": {}, "ipfs": {}}
+    references = load_references(references_file) or {"swarm": {}, "ipfs": {}}
 
     if args.upload:
-        while True:
-            for r in range(repeat_count):
-
-                random_bin = generate_random_binary_data(args.size)
-                sha256_hash = hashlib.sha256(random_bin).hexdigest()
-                logging.info(f'Generated {args.size}kb file. SHA256 hash of upload: {sha256_hash}')
-
-                start_upload_time = time.time()
-                response = upload_file(random_bin, swarm_ul_server)
-                upload_duration = time.time() - start_upload_time
-
-                if 200 <= response.status_code < 300:
-                    response_data = response.json()
-                    response_file_swarmhash = response_data.get("reference", "")
-                    logging.info(f'Successfully uploaded file. Swarmhash: {response_file_swarmhash}')
-                    logging.info(f'https://download.gateway.ethswarm.org/bzz/{response_file_swarmhash}')
-
-                    # Store reference, upload time, and SHA256 hash
-                    references.setdefault("swarm", {}).setdefault(str(args.size), []).append({
-                        "hash": response_file_swarmhash, 
-                        "sha256": sha256_hash,
-                        "upload_time": upload_duration,  # Add upload time here
-                        "timestamp": datetime.datetime.now(pytz.utc).isoformat(),
-                        "ul_redundancy": args.ul_redundancy
-                    })
-                    logging.info(f'Upload to swarm duration: {upload_duration}')
-                else:
-                    logging.info(f'Error: Failed to upload: {response.status_code}')
-                
+        references_journal = JsonLinesLog(references_file + 'l', fsync_every=1)
+
+        def add_reference(storage, entry):
+            references.setdefault(storage, {}).setdefault(str(args.size), []).append(entry)
+            references_journal.append({"storage": storage, "size": str(args.size), "entry": entry})
+
+        async def upload_one(r):
+            cell = {"phase": "upload", "campaign": args.campaign, "size": str(args.size), "ul_redundancy": args.ul_redundancy, "dl_redundancy": args.dl_redundancy, "replicate": r, "server": swarm_ul_server[0]}
+            if args.resume and state.is_done(cell):
+                logging.info(f'Replicate {r} already uploaded, skipping')
+                return
+
+            seed = new_payload_seed()
+            entry = await get_backend("swarm").upload(args.size, seed, r, args.ul_redundancy)
+            if entry:
+                # Store reference, upload time, and SHA256 hash
+                add_reference("swarm", entry)
+
+            if not args.only_swarm:
+                # The same payload goes to Arweave and Pinata
+                for key in ("arweave", "ipfs"):
+                    try:
+                        entry = await get_backend(key).upload(args.size, seed, r)
+                    except Exception as e:
+                        logging.error(f"Error uploading to {key}: {str(e)}")
+                        continue
+                    if entry:
+                        add_reference(key, entry)
+
+            state.mark_done(cell)
 
-                if not args.only_swarm:
-                    # Upload to Arweave and pinata using a temporary file
-                    with tempfile.NamedTemporaryFile(dir=ipfs_data_dir, delete=False, mode='wb', suffix='.bin') as tmpfile:
-                        tmpfile.write(random_bin)
-                        tmpfile.flush()  # Ensure all data is written
-
-                        try:
-                            with open(tmpfile.name, 'rb') as f:
-                                files = {'file': f}
-                                arw_start_upload_time = time.time()
-                                arw_response = arw_file_manager.upload(tmpfile.name, tags_dict={'filename': tmpfile.name})
-                                arw_upload_duration = time.time() - arw_start_upload_time
-                                logging.info(f'Upload to arweave duration: {arw_upload_duration}')
-                                arw_transaction_id = arw_response.id
-                                if arw_transaction_id:
-                                    logging.info(f'Successfully uploaded file to ARWEAVE. transaction: {arw_transaction_id}')
-                                    # Store Arweave reference, upload time, and SHA256 hash
-                                    references.setdefault("arweave", {}).setdefault(str(args.size), []).append({
-                                        "hash": arw_transaction_id, 
-                                        "sha256": sha256_hash,
-                                        "upload_time": arw_upload_duration,  # Add upload time here
-                                        "timestamp": datetime.datetime.now(pytz.utc).isoformat()
-                                    })
-                                else:
-                                    logging.warning(f"Failed to get transaction ID from Arweave response. Response: {arw_response}")
-                        except Exception as e:
-                            logging.error(f"Error uploading: {str(e)}")
-                            
-                        # Upload to Pinata
-                        pinata_start_upload_time = time.time()
-                        pinata_response = await pin_file_to_ipfs(PINATA_JWT, tmpfile.name, f'speedtest-{args.size}kb-{r}')
-                        pinata_upload_duration = time.time() - pinata_start_upload_time
-                        
-                        if pinata_response:
-                            ipfs_hash = pinata_response['IpfsHash']
-                            ipfs_pin_size = pinata_response['PinSize']
-                            ipfs_timestamp = pinata_response['Timestamp']
-
-                            logging.info(f'Successfully uploaded file to Pinata. IPFS Hash: {ipfs_hash}, Pin Size: {ipfs_pin_size}, Timestamp: {ipfs_timestamp}')
-                        else:
-                            logging.warning(f"Failed to get transaction ID from Arweave response. Response: {arw_response}")
-
-                        # Store Pinata reference, upload time, and SHA256 hash
-                        references.setdefault("ipfs", {}).setdefault(str(args.size), []).append({
-                            "hash": ipfs_hash,
-                            "sha256": sha256_hash,
-                            "upload_time": pinata_upload_duration,
-                            "timestamp": ipfs_timestamp
-                        })
-
-                # Save references to JSON file after each upload
-                with open(references_file, 'w') as f:
-                    json.dump(references, f, indent=4)
+        while True:
+            # All uploads go to the same server, so one limit covers both.
+            upload_tasks = [(swarm_ul_server[0], upload_one(r)) for r in range(repeat_count)]
+            for result in await run_bounded(upload_tasks, ConcurrencyLimits(args.ul_concurrency, args.ul_concurrency)):
+                if isinstance(result, Exception):
+                    logging.error(f'Upload failed: {str(result)}')
             if not continuous:
                 break
 
+        references_journal.close()
+        compact_references(references, references_file)
+
     if args.download:
         # Read the references from file
-        if os.path.exists(references_file):
-            with open(references_file, 'r') as f:
-                references = json.load(f)
-        else:
+        references = load_references(references_file)
+        if references is None:
             logging.error("References file not found. Exiting download.")
             sys.exit(1)
+        results_log = open_results_log(results_file)
+        run_timestamp = datetime.datetime.now(pytz.utc).isoformat()
+        synced = sync_waiter(args)
+
+        async def recorded(cell, task, ready=None):
+            # Log each result as soon as its download finishes, so an interrupted
+            # round keeps what it already measured.
+            result = await task
+            tags = {"time_to_retrievable": ready.result()} if ready is not None else None
+            result_dict = record_download(result, results_log, run_timestamp, args.dl_redundancy, args.dl_retrieval, tags)
+            results_by_storage[result[6]].append(result_dict)
+            state.mark_done(cell)
+            return result
+
+        def recorded_remote(host):
+            # Results streamed back by a worker are logged like local ones
+            def record(cell, ready, result):
+                tags = {"worker": host}
+                if ready is not None:
+                    tags["time_to_retrievable"] = ready.result()
+                result_dict = record_download(result, results_log, run_timestamp, args.dl_redundancy, args.dl_retrieval, tags)
+                results_by_storage[result[6]].append(result_dict)
+                state.mark_done(cell)
+            return record
+
+        def download_cell(storage, size, ul_redundancy, replicate, server, r):
+            cell = {"phase": "download", "campaign": args.campaign, "storage": storage, "size": size, "ul_redundancy": ul_redundancy, "dl_redundancy": args.dl_redundancy,
+                    "replicate": replicate, "server": server, "round": r}
+            return None if args.resume and state.is_done(cell) else cell
 
         while True:
             for r in range(repeat_count):
@@ -702,54 +2834,82 @@ async def main(args):
                 swarm_tasks = []
                 ipfs_tasks = []
                 arw_tasks = []
+                remote_work = {}
 
                 # Create download tasks for Swarm
                 if "swarm" in references:
                     for size, swarm_entries in references["swarm"].items():
-                        for entry in swarm_entries:
+                        for replicate, entry in enumerate(swarm_entries):
                             swarmhash = entry["hash"]
                             sha256_hash = entry["sha256"]
                             redundancy = entry["ul_redundancy"]
+                            if args.race:
+                                cell = download_cell("swarm", size, redundancy, entry.get("replicate", replicate), 'race', r)
+                                if cell is not None:
+                                    task = get_backend("swarm").race(swarm_dl_servers, swarmhash, sha256_hash, 15, size, redundancy)
+                                    ready = synced(entry, size)
+                                    swarm_tasks.append(('race', recorded(cell, task, ready), ready))
+                                continue
+                            if args.ssh_workers:
+                                for host, servers in ssh_workers.items():
+                                    for url in servers:
+                                        cell = download_cell("swarm", size, redundancy, entry.get("replicate", replicate), f"{host}/{url}", r)
+                                        if cell is None:
+                                            continue
+                                        item = {"server": url, "hash": swarmhash, "sha256": sha256_hash, "size": size, "ul_redundancy": redundancy,
+                                                "dl_redundancy": args.dl_redundancy, "dl_retrieval": args.dl_retrieval}
+                                        remote_work.setdefault(host, []).append((cell, item, synced(entry, size)))
+                                continue
                             for url in swarm_dl_servers:
-                                task = http_curl(url, swarmhash, sha256_hash, 15, size, redundancy)
-                                swarm_tasks.append(task)
+                                cell = download_cell("swarm", size, redundancy, entry.get("replicate", replicate), url, r)
+                                if cell is None:
+                                    continue
+                                task = get_backend("swarm").download(url, swarmhash, sha256_hash, 15, size, redundancy)
+                                ready = synced(entry, size)
+                                swarm_tasks.append((url, recorded(cell, task, ready), ready))
 
                 if not args.only_swarm:
                     # Create download tasks for IPFS
                     if "ipfs" in references:
                         for size, ipfs_entries in references["ipfs"].items():
-                            for entry in ipfs_entries:
+                            for replicate, entry in enumerate(ipfs_entries):
                                 ipfs_hash = entry["hash"]
                                 sha256_hash = entry["sha256"]
                                 for url in ipfs_dl_servers:
-                                    task = http_ipfs(url, ipfs_hash, sha256_hash, 15, size)
-                                    ipfs_tasks.append(task)
+                                    cell = download_cell("ipfs", size, None, replicate, url, r)
+                                    if cell is None:
+                                        continue
+                                    task = get_backend("ipfs").download(url, ipfs_hash, sha256_hash, 15, size)
+                                    ipfs_tasks.append((url, recorded(cell, task)))
 
                     # Create download tasks for Arweave
                     if "arweave" in references:
                         for size, arweave_entries in references["arweave"].items():
-                            for entry in arweave_entries:
+                            for replicate, entry in enumerate(arweave_entries):
                                 arw_transaction_id = entry["hash"]
                                 sha256_hash = entry["sha256"]
                                 for url in arw_dl_servers:
-                                    task = http_arw(url, arw_transaction_id, sha256_hash, 15, size)
-                                    arw_tasks.append(task)
-
-                # Combine all tasks and run them asynchronously
+                                    cell = download_cell("arweave", size, None, replicate, url, r)
+                                    if cell is None:
+                                        continue
+                                    task = get_backend("arweave").download(url, arw_transaction_id, sha256_hash, 15, size)
+                                    arw_tasks.append((url, recorded(cell, task)))
+
+                # Combine all tasks and run them with bounded concurrency. With the
+                # defaults (1 global, 1 per server) this is the old serial behaviour.
                 all_tasks = arw_tasks + swarm_tasks + ipfs_tasks
-                #results = await asyncio.gather(*all_tasks, return_exceptions=True)
-                # Run tasks serially and append results
-                results = []
-                for task in all_tasks:
-                    result = await task
-                    results.append(result)
-            
-                # Process the results
-                #for result in results:
-                #    if isinstance(result, Exception):
-                #        print(f"Error downloading: {result}")
-                #    else:
-                #        print(f"Download successful: {result}")
+                remote_tasks = [run_remote_downloads(host, work, recorded_remote(host)) for host, work in remote_work.items()]
+                results, *remote_results = await asyncio.gather(
+                    run_bounded(all_tasks, ConcurrencyLimits(args.dl_concurrency, args.dl_server_concurrency)),
+                    *remote_tasks, return_exceptions=True)
+                if isinstance(results, Exception):
+                    logging.error(f'Local downloads failed: {str(results)}')
+                    results = []
+                for host, remote in zip(remote_work, remote_results):
+                    if isinstance(remote, Exception):
+                        logging.error(f'Worker on {host} failed: {str(remote)}')
+                    else:
+                        results += remote
 
                 fastest_time = float('inf')
                 fastest_server = None
@@ -767,38 +2927,9 @@ async def main(args):
                     if isinstance(result, Exception):
                         logging.error(f'Task failed: {str(result)}')
                     else:                        
-                        elapsed_time, sha256sum_output, server_loc, server, ip, attempts, storage, size, reference, redundancy = result
-                        
-                        # Create a result dictionary
-                        result_dict = {
-                            "server": server,
-                            "ip": ip,
-                            "latitude": server_loc.latitude if server_loc else None,
-                            "longitude": server_loc.longitude if server_loc else None,
-                            "download_time_seconds": elapsed_time,
-                            "sha256_match": sha256sum_output,
-                            "attempts": attempts,
-                            "size": size,
-                            "ref": reference,
-                            "dl_redundancy": args.dl_redundancy,
-                            "dl_retrieval-timeout": args.dl_retrieval,
-                            "ul_redundancy": redundancy
-                        }
-                        # Append the result to the corresponding storage list
-                        results_by_storage[storage].append(result_dict) 
-
-                        logging.info("-----------------START-----------------------")
-                        logging.info(f"size: {size}kb")
-                        logging.info(f"{storage} initial download time: {elapsed_time} seconds from {server_loc.city if server_loc else 'Unknown'} - {server} within {attempts} attempts. Size {size} ")
-
-                        if sha256sum_output == 'true':
-                            logging.info("SHA256 hashes match.")
-                            DL_TIME.labels(storage=storage, server=server, latitude=server_loc.latitude, longitude=server_loc.longitude, size=size, dl_redundancy=args.dl_redundancy, ul_redundancy=redundancy, dl_retrieval=args.dl_retrieval).observe(elapsed_time)
-                            DL_TIME_SUM.labels(storage=storage, server=server, latitude=server_loc.latitude, longitude=server_loc.longitude, size=size).observe(elapsed_time)
-                        else:
-                            logging.info("SHA256 hashes do !NOT! match.")
-                            NO_MATCH.labels(storage=storage, server=server, latitude=server_loc.latitude, longitude=server_loc.longitude, size=size).inc()
-                        logging.info("-----------------END-------------------------")
+                        elapsed_time, sha256sum_output, server_loc, server, ip, attempts, storage, size, reference, redundancy, details = result
+
+                        observe_download(result, args.dl_redundancy, args.dl_retrieval)
 
                         if elapsed_time < fastest_time:
                             fastest_time = elapsed_time
@@ -814,42 +2945,43 @@ async def main(args):
                             slowest_ip = ip
                             slowest_attempts = attempts
 
-                        push_to_gateway(prometheus_gw, job=job_label, registry=registry, handler=pgw_auth_handler)
+                        metrics_exporter.mark_dirty()
                 logging.info("-----------------SUMMARY START-----------------------")
                 logging.info(f"Fastest time: {fastest_time} for server {fastest_server} and IP {fastest_ip} with {fastest_attempts} attempts")
                 logging.info(f"Slowest time: {slowest_time} for server {slowest_server} and IP {slowest_ip} with {slowest_attempts} attempts")
-                DL_TIME_EXTREMES.labels(storage=fastest_storage, server=server, latitude=server_loc.latitude, longitude=server_loc.longitude, size=size).set(fastest_time)
-                DL_TIME_EXTREMES.labels(storage=slowest_storage, server=server, latitude=server_loc.latitude, longitude=server_loc.longitude, size=size).set(slowest_time)
+                DL_TIME_EXTREMES.labels(storage=fastest_storage, server=server, size=size).set(fastest_time)
+                DL_TIME_EXTREMES.labels(storage=slowest_storage, server=server, size=size).set(slowest_time)
 
                 logging.info("-----------------SUMMARY END-------------------------")
 
-            push_to_gateway(prometheus_gw, job=job_label, registry=registry, handler=pgw_auth_handler)
+            metrics_exporter.mark_dirty()
             for storage, storage_results in results_by_storage.items():
                 logging.info(f"Results for {storage}:")
                 for result in storage_results:
                     logging.info(result)
-        
-                # Save the results to the JSON file
-                save_test_results([
-                    {
-                        "timestamp": datetime.datetime.now(pytz.utc).isoformat(),
-                        "size_kb": size,
-                        "storage": storage,
-                        "results": storage_results
-                    }
-                ], results_file)
+
+            # Rebuild the results JSON file from the log
+            results_log.sync()
+            export_results(results_file)
 
             logging.info('All repeats done')
             if not continuous:
                 break
 
+        results_log.close()
+        if args.archive_references:
+            archive_references(references_file, args.archive_references, args.ul_redundancy, args.dl_redundancy)
+        state.mark_done(run_cell(args))
 
-if __name__ == '__main__':
-    logging.info('Welcome to web3 storage speed test')
-    hostname = os.getenv('HOSTNAME', 'unknown')
-    job_label = f'web3storage_speed_{hostname}'
-    load_config('data/config.json')
+    state.close()
+
+
+def build_parser():
+    """Returns the command line parser; bench.py uses it for the defaults."""
     parser = argparse.ArgumentParser(description='Swarm speed test for Gnosis.')
+    parser.add_argument('command', nargs='?', choices=['campaign', 'loadtest', 'worker', 'chunks', 'ranges'], help='campaign: run the whole factorial design given by --design in this process; loadtest: find the concurrency a Bee node sustains; worker: download work items from stdin (started by --ssh-workers); chunks: time the retrieval of every chunk of the stored references; ranges: time partial reads into the stored references')
+    parser.add_argument('--design', type=str, default='campaign.json', help='campaign design spec (see campaign.json.example)')
+    parser.add_argument('--references-dir', type=str, default='references', help='directory for the per-cell references files of a campaign')
     parser.add_argument('--url', type=str, default="https://bee-1.fairdatasociety.org/bzz", help='URL for uploading data')
     parser.add_argument('--size', type=int, default=100, help='size of data in kb')
     parser.add_argument('--ul-redundancy', type=int, default=0, help='swarm upload redundancy lvl')
@@ -861,8 +2993,66 @@ if __name__ == '__main__':
     parser.add_argument('--gateway', action='store_true', help='Gateways Download')
     parser.add_argument('--download', action='store_true', help='Download')
     parser.add_argument('--only-swarm', action='store_true', help='Test only swarm')
+    parser.add_argument('--export-results', action='store_true', help='Rebuild the results JSON file from its append-only log')
+    parser.add_argument('--state-file', type=str, default='campaign_state.jsonl', help='file recording which cells of the campaign are done')
+    parser.add_argument('--resume', action='store_true', help='skip uploads and downloads already recorded in the state file')
+    parser.add_argument('--campaign', type=str, help='campaign the cells in the state file belong to, so that --resume and --cell-done only see this campaign\'s cells')
+    parser.add_argument('--cell-done', action='store_true', help='exit with status 0 if the cell given by --size/--ul-redundancy/--dl-redundancy is done, 1 otherwise')
+    parser.add_argument('--archive-references', type=str, help='after downloading, move the references file into this directory')
+    parser.add_argument('--sync-wait', choices=['fixed', 'probe'], default='fixed', help='fixed: wait the whole sync delay, probe: download as soon as a probe node finds the data retrievable')
+    parser.add_argument('--probe-server', type=str, help='Bee node used for probing; should not be one of the download servers')
+    parser.add_argument('--probe-method', choices=['stewardship', 'chunk'], default='stewardship', help='stewardship: check all chunks, chunk: fetch only the root chunk')
+    parser.add_argument('--probe-interval', type=float, default=10, help='seconds before the first re-probe; doubles after every miss')
+    parser.add_argument('--probe-max-wait', type=float, default=7200, help='download anyway this many seconds after the upload')
+    parser.add_argument('--dl-concurrency', type=int, default=1, help='max downloads in flight overall')
+    parser.add_argument('--dl-server-concurrency', type=int, default=1, help='max downloads in flight per download server')
+    parser.add_argument('--ul-concurrency', type=int, default=1, help='max uploads in flight against the upload server')
+    parser.add_argument('--connection', choices=['cold', 'warm'], default='cold', help='cold: new connection per download, warm: reuse pooled connections')
+    parser.add_argument('--conn-limit', type=int, default=100, help='max pooled connections overall')
+    parser.add_argument('--conn-limit-per-host', type=int, default=10, help='max pooled connections per host')
+    parser.add_argument('--keepalive-timeout', type=float, default=60, help='seconds to keep idle pooled connections open')
+    parser.add_argument('--dns-cache-ttl', type=int, default=3600, help='seconds to cache DNS answers in the pool')
+    parser.add_argument('--retry-backoff', type=float, default=0, help='base seconds of jittered exponential backoff between download attempts (0 retries at once)')
+    parser.add_argument('--retry-backoff-max', type=float, default=30, help='upper bound of the backoff between download attempts')
+    parser.add_argument('--hedge-percentile', type=float, help='start a second request once an attempt is slower than this percentile of earlier attempts')
+    parser.add_argument('--hedge-after', type=float, help='hedge delay in seconds until enough attempts have been seen for the percentile')
+    parser.add_argument('--race', action='store_true', help='download every Swarm reference from all servers at once; the first verified body wins')
+    parser.add_argument('--race-grace', type=float, default=0, help='seconds the race losers may keep running after the winner, to measure the spread')
+    parser.add_argument('--load-op', choices=['download', 'upload'], default='download', help='what the load test sends')
+    parser.add_argument('--load-server', type=str, help='Bee node to load test (default: first download or upload server)')
+    parser.add_argument('--load-levels', type=str, default='32', help='concurrency levels, e.g. "1,2,4,8", or a maximum N for 1, 2, 4, ... N')
+    parser.add_argument('--step-duration', type=float, default=60, help='seconds to hold each concurrency level')
+    parser.add_argument('--load-references', type=str, default=references_file_onlyswarm, help='references to download in the load test')
+    parser.add_argument('--load-results', type=str, default='loadtest.jsonl', help='file the load test steps are appended to')
+    parser.add_argument('--knee-gain', type=float, default=0.1, help='minimum relative throughput gain for a level to count as paying off')
+    parser.add_argument('--knee-latency', type=float, default=2.0, help='maximum p95 latency, as a multiple of the lowest level, before latency counts as degraded')
+    parser.add_argument('--max-error-rate', type=float, default=0.05, help='maximum error rate of a level before the node counts as saturated')
+    parser.add_argument('--ssh-workers', action='store_true', help='run the Swarm downloads on the ssh_workers hosts from the config, each against its own Bee servers')
+    parser.add_argument('--worker-command', type=str, default='cd util_web3_storageperf && python3 app.py', help='how to start app.py on the worker hosts')
+    parser.add_argument('--verify-upload', action='store_true', help='check every Swarm upload against the reference computed locally from its seed')
+    parser.add_argument('--chunk-concurrency', type=int, default=16, help='chunks fetched at the same time in chunks mode')
+    parser.add_argument('--chunk-results', type=str, default='chunks.jsonl', help='file the chunks mode results are appended to')
+    parser.add_argument('--range-lengths', type=str, default='4096,65536,1048576', help='comma-separated read lengths in bytes for ranges mode')
+    parser.add_argument('--range-offsets', type=str, default='random', help="'random', or comma-separated byte offsets to read at in ranges mode")
+    parser.add_argument('--range-reads', type=int, default=20, help='reads per file and length at random offsets in ranges mode')
+    parser.add_argument('--range-seed', type=int, help='seed for the random offsets, to repeat the same reads')
+    parser.add_argument('--range-min-size', type=int, default=10240, help='only read into files of at least this many kb in ranges mode')
+    parser.add_argument('--range-concurrency', type=int, default=1, help='range requests in flight at the same time in ranges mode')
+    parser.add_argument('--range-results', type=str, default='ranges.jsonl', help='file the ranges mode results are appended to')
+    parser.add_argument('--push-interval', type=float, default=15.0, help='push metrics to the pushgateway at most once per this many seconds')
+    parser.add_argument('--metrics-port', type=int, help='serve /metrics on this port for scraping instead of pushing')
+    parser.add_argument('--lookup-cache', default=LOOKUP_CACHE_FILE, help='file caching DNS and ipinfo lookups across runs')
+    return parser
 
+if __name__ == '__main__':
+    logging.info('Welcome to web3 storage speed test')
+    hostname = os.getenv('HOSTNAME', 'unknown')
+    job_label = f'web3storage_speed_{hostname}'
+    load_config('data/config.json')
+    parser = build_parser()
     args = parser.parse_args()
+    if args.sync_wait == 'probe' and not args.probe_server:
+        parser.error('--sync-wait probe needs --probe-server')
     signal.signal(signal.SIGINT, signal_handler)
     asyncio.run(main(args))
 
@@ -0,0 +1,222 @@
+#!/bin/python3
+"""Benchmarks the overhead of the harness itself against the local mock gateway.
+
+Runs the download and upload paths of app.py against mock_gateway.py without any
+injected latency, so everything measured is the harness:
+
+- overhead: median time of http_curl / http_ipfs minus a bare aiohttp GET of the same file
+- memory: Python heap high-water mark of one large download and one large upload
+- throughput: files/s and MB/s of http_curl, http_ipfs and upload_file at a fixed concurrency
+- startup: median time to import app.py and parse a Swarm-only command line, in a fresh
+  interpreter, and how many of the backend client libraries that pulled in
+
+Results can be written with --output and compared to an earlier run with --compare,
+so changes to the tool can be checked for regressions offline.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import aiohttp
+
+import app
+
+MB = 1024 * 1024
+
+async def start_gateway(port):
+    """Starts mock_gateway.py in its own process, so it does not share our event loop."""
+    process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_gateway.py'),
+                                '--port', str(port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f'http://127.0.0.1:{port}/stewardship/none') as response:
+                    if response.status == 200:
+                        return process
+        except aiohttp.ClientError:
+            await asyncio.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Mock gateway did not come up on port {port}")
+
+async def upload(target, size_kb):
+    """Uploads a random file through `app.upload_file` and returns (reference, sha256)."""
+    sha256 = hashlib.sha256()
+    status, response_data, _ = await app.upload_file(app.random_payload(size_kb, app.new_payload_seed(), sha256), size_kb * 1024, [f'http://{target}/bzz'])
+    if status != 201:
+        raise RuntimeError(f"Upload to {target} failed with status {status}")
+    return response_data["reference"], sha256.hexdigest()
+
+async def raw_get(url):
+    """Downloads `url` with bare aiohttp, the way the harness connects but without any of its work."""
+    async with app.download_session() as session:
+        async with session.get(url) as response:
+            async for _ in response.content.iter_chunked(app.DOWNLOAD_CHUNK_SIZE):
+                pass
+
+async def bench_overhead(target, sizes, rounds):
+    """Returns the median download time of the harness and of a bare GET, per path and size."""
+    results = {}
+    for size_kb in sizes:
+        reference, sha256 = await upload(target, size_kb)
+        timings = {"raw": [], "http_curl": [], "http_ipfs": []}
+        for _ in range(rounds):
+            start = time.perf_counter()
+            await raw_get(f'http://{target}/bzz/{reference}')
+            timings["raw"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            result = await app.http_curl(target, reference, sha256, 1, str(size_kb), 0)
+            timings["http_curl"].append(time.perf_counter() - start)
+            if result[1] != 'true':
+                raise RuntimeError(f"http_curl failed to verify {reference}")
+
+            start = time.perf_counter()
+            result = await app.http_ipfs(target, reference, sha256, 1, str(size_kb))
+            timings["http_ipfs"].append(time.perf_counter() - start)
+            if result[1] != 'true':
+                raise RuntimeError(f"http_ipfs failed to verify {reference}")
+
+        raw = statistics.median(timings["raw"])
+        for path in ("http_curl", "http_ipfs"):
+            median = statistics.median(timings[path])
+            results[f"overhead_ms/{path}/{size_kb}kb"] = (median - raw) * 1000
+        results[f"raw_ms/{size_kb}kb"] = raw * 1000
+    return results
+
+async def bench_memory(target, size_kb):
+    """Returns the Python heap high-water mark of one download and one upload of `size_kb`."""
+    reference, sha256 = await upload(target, size_kb)
+
+    tracemalloc.start()
+    await app.http_curl(target, reference, sha256, 1, str(size_kb), 0)
+    _, download_peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    await upload(target, size_kb)
+    _, upload_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {f"peak_mb/download/{size_kb}kb": download_peak / MB, f"peak_mb/upload/{size_kb}kb": upload_peak / MB}
+
+async def bench_throughput(target, size_kb, concurrency, duration):
+    """Returns files/s and MB/s of each path with `concurrency` requests in flight for `duration` seconds."""
+    reference, sha256 = await upload(target, size_kb)
+    paths = {
+        "http_curl": lambda: app.http_curl(target, reference, sha256, 1, str(size_kb), 0),
+        "http_ipfs": lambda: app.http_ipfs(target, reference, sha256, 1, str(size_kb)),
+        "upload_file": lambda: upload(target, size_kb),
+    }
+    results = {}
+    for path, request in paths.items():
+        done = 0
+        deadline = time.monotonic() + duration
+
+        async def worker():
+            nonlocal done
+            while time.monotonic() < deadline:
+                await request()
+                done += 1
+
+        start = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.monotonic() - start
+        results[f"files_per_second/{path}/{size_kb}kb"] = done / elapsed
+        results[f"mb_per_second/{path}/{size_kb}kb"] = done * size_kb * 1024 / elapsed / 1e6
+    return results
+
+# Client libraries only some backends need; a Swarm-only run should load none of them.
+BACKEND_MODULES = ['ritual_arweave', 'ipinfo', 'asyncssh', 'requests', 'Crypto', 'numpy']
+
+def bench_startup(rounds):
+    """Returns the median startup time of a Swarm-only run and the backend modules it loads."""
+    code = ("import json, sys, time; start = time.perf_counter(); import app; "
+            "app.build_parser().parse_args(['--only-swarm']); "
+            "print(json.dumps([time.perf_counter() - start, [m for m in json.loads(sys.argv[1]) if m in sys.modules]]))")
+    here = os.path.dirname(os.path.abspath(__file__))
+    in_process, wall = [], []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code, json.dumps(BACKEND_MODULES)], cwd=here,
+                                capture_output=True, text=True, check=True).stdout
+        wall.append(time.perf_counter() - start)
+        elapsed, loaded = json.loads(output.splitlines()[-1])
+        in_process.append(elapsed)
+    if loaded:
+        logging.warning(f"Swarm-only startup loads {', '.join(loaded)}")
+    return {"startup_ms/import": statistics.median(in_process) * 1000,
+            "startup_ms/process": statistics.median(wall) * 1000,
+            "startup_backend_modules": len(loaded)}
+
+def compare(results, baseline):
+    """Prints how every result changed against an earlier run."""
+    print(f"\n{'benchmark':<45} {'baseline':>12} {'now':>12} {'change':>9}")
+    for name, value in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        change = f"{(value - old) / abs(old):+.1%}" if old else "n/a"
+        print(f"{name:<45} {old:>12.3f} {value:>12.3f} {change:>9}")
+
+async def main(bench_args):
+    results = {}
+    if 'startup' in bench_args.benchmarks:
+        results.update(bench_startup(bench_args.rounds))
+    if not {'overhead', 'memory', 'throughput'} & set(bench_args.benchmarks):
+        return results
+
+    gateway = None
+    target = bench_args.target
+    if target is None:
+        gateway = await start_gateway(bench_args.port)
+        target = f'127.0.0.1:{bench_args.port}'
+
+    app.args = app.build_parser().parse_args(['--connection', bench_args.connection, '--conn-limit-per-host', str(bench_args.concurrency)])
+    app.swarm_batch_id = '0' * 64
+    app.http_session = app.new_http_session()
+    try:
+        if 'overhead' in bench_args.benchmarks:
+            results.update(await bench_overhead(target, bench_args.sizes, bench_args.rounds))
+        if 'memory' in bench_args.benchmarks:
+            results.update(await bench_memory(target, bench_args.memory_size))
+        if 'throughput' in bench_args.benchmarks:
+            results.update(await bench_throughput(target, bench_args.throughput_size, bench_args.concurrency, bench_args.duration))
+    finally:
+        await app.http_session.close()
+        if gateway is not None:
+            gateway.terminate()
+            gateway.wait()
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the overhead of the storage speed test harness.')
+    parser.add_argument('benchmarks', nargs='*', default=['overhead', 'memory', 'throughput', 'startup'], help='benchmarks to run: overhead, memory, throughput, startup')
+    parser.add_argument('--target', type=str, help='host:port of an already running mock gateway (default: start one)')
+    parser.add_argument('--port', type=int, default=18633, help='port for the mock gateway started by the benchmark')
+    parser.add_argument('--connection', choices=['cold', 'warm'], default='cold', help='connection mode of the harness, as in app.py')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 1024, 10240], help='file sizes in kb for the overhead benchmark')
+    parser.add_argument('--rounds', type=int, default=20, help='downloads per path and size in the overhead benchmark, interpreters started in the startup benchmark')
+    parser.add_argument('--memory-size', type=int, default=65536, help='file size in kb for the memory benchmark')
+    parser.add_argument('--throughput-size', type=int, default=100, help='file size in kb for the throughput benchmark')
+    parser.add_argument('--concurrency', type=int, default=16, help='requests in flight in the throughput benchmark')
+    parser.add_argument('--duration', type=float, default=5, help='seconds per path in the throughput benchmark')
+    parser.add_argument('--output', type=str, help='write the results to this JSON file')
+    parser.add_argument('--compare', type=str, help='compare the results to an earlier --output file')
+    bench_args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = asyncio.run(main(bench_args))
+
+    for name, value in results.items():
+        print(f"{name:<45} {value:>12.3f}")
+    if bench_args.output:
+        with open(bench_args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    if bench_args.compare:
+        with open(bench_args.compare, 'r') as f:
+            compare(results, json.load(f))
@@ -0,0 +1,212 @@
+#!/bin/python3
+"""Local stand-in for a Bee node and an IPFS gateway.
+
+Serves the endpoints app.py talks to, so the harness can be run and benchmarked
+without live nodes:
+
+- POST /bzz stores the body and answers with its reference: the SHA256 of the
+  body, or with --swarm-addressing the real Swarm manifest reference
+- GET /bzz/{reference}, GET /bytes/{reference} and GET /ipfs/{cid} return a stored
+  body, gzipped if the server runs with --gzip and the client accepts it; single
+  `Range` requests are answered with 206
+- GET /stewardship/{reference} answers sync probes, GET /chunks/{reference} serves
+  chunks (the real chunk tree and manifest with --swarm-addressing)
+
+Latency, bandwidth and errors can be injected to see how the harness reacts.
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import logging
+import random
+
+from aiohttp import web
+
+import swarm_bmt
+
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+
+SEND_CHUNK_SIZE = 64 * 1024
+
+def store_manifest(chunks, name, data_reference, content_type):
+    """
+    Builds the mantaray manifest Bee puts around a file uploaded to /bzz.
+
+    The root has a "/" fork naming the file as index document, and the file's path
+    leads, in forks of at most 30 bytes, to the node pointing at the data.
+
+    Args:
+        chunks (dict): Chunk store the manifest nodes are added to.
+        name (str): The file name.
+        data_reference (str): Hex reference of the file data.
+        content_type (str): Stored in the file's metadata.
+
+    Returns:
+        str: The hex reference of the manifest.
+    """
+    def store_node(node):
+        chunk = swarm_bmt.encode_span(len(node)) + node
+        address = swarm_bmt.chunk_address(chunk).hex()
+        chunks[address] = chunk
+        return address
+
+    value_with_metadata = swarm_bmt.NODE_TYPE_VALUE | swarm_bmt.NODE_TYPE_WITH_METADATA
+    path = name.encode()
+    segments = [path[i:i + swarm_bmt.FORK_PREFIX_SIZE] for i in range(0, len(path), swarm_bmt.FORK_PREFIX_SIZE)]
+    child = store_node(swarm_bmt.marshal_manifest_node(entry=data_reference))
+    fork = {"type": value_with_metadata, "reference": child, "metadata": {"Content-Type": content_type, "Filename": name}}
+    for segment in reversed(segments[1:]):
+        child = store_node(swarm_bmt.marshal_manifest_node(forks={segment: fork}))
+        fork = {"type": swarm_bmt.NODE_TYPE_EDGE, "reference": child, "metadata": None}
+    index = store_node(swarm_bmt.marshal_manifest_node())
+    return store_node(swarm_bmt.marshal_manifest_node(forks={
+        segments[0]: fork,
+        b'/': {"type": value_with_metadata, "reference": index, "metadata": {"website-index-document": name}},
+    }))
+
+def make_app(latency=0.0, jitter=0.0, bandwidth=None, error_rate=0.0, corrupt_rate=0.0, use_gzip=False, seed=None, swarm_addressing=False):
+    """
+    Builds the mock gateway application.
+
+    Args:
+        latency (float): Seconds to wait before answering a request.
+        jitter (float): Up to this many seconds are added to `latency` at random.
+        bandwidth (float, optional): Bytes per second a download body is sent at; unlimited if None.
+        error_rate (float): Fraction of downloads answered with HTTP 500.
+        corrupt_rate (float): Fraction of downloads whose body has one byte flipped.
+        use_gzip (bool): Gzip download bodies for clients that accept it.
+        seed (int, optional): Seed for the random error injection.
+        swarm_addressing (bool): Address uploads like Bee does, with chunk tree and
+            manifest, instead of by their SHA256. Costs CPU on every upload.
+
+    Returns:
+        web.Application: The application; stored bodies live in `app["store"]`.
+    """
+    rng = random.Random(seed)
+    store = {}
+    chunks = {}
+
+    async def delay():
+        wait = latency + (rng.uniform(0, jitter) if jitter else 0)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def upload(request):
+        body = await request.read()
+        if swarm_addressing:
+            data_reference = await asyncio.to_thread(swarm_bmt.swarm_reference, [body], chunks)
+            name = request.query.get("name", data_reference)
+            reference = store_manifest(chunks, name, data_reference, request.headers.get("Content-Type", "application/octet-stream"))
+            store[data_reference] = body
+        else:
+            reference = hashlib.sha256(body).hexdigest()
+        store[reference] = body
+        await delay()
+        return web.json_response({"reference": reference}, status=201)
+
+    async def download(request):
+        reference = request.match_info["reference"]
+        await delay()
+        body = store.get(reference)
+        if body is None:
+            return web.Response(status=404, text="not found")
+        if rng.random() < error_rate:
+            return web.Response(status=500, text="injected error")
+        if rng.random() < corrupt_rate:
+            position = rng.randrange(len(body))
+            body = body[:position] + bytes([body[position] ^ 0xff]) + body[position + 1:]
+
+        status = 200
+        content_range = None
+        if request.http_range.start is not None or request.http_range.stop is not None:
+            size = len(body)
+            start, stop, _ = request.http_range.indices(size)
+            if start >= stop:
+                return web.Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+            body = body[start:stop]
+            status = 206
+            content_range = f"bytes {start}-{stop - 1}/{size}"
+
+        response = web.StreamResponse(status=status)
+        response.content_type = "application/octet-stream"
+        if content_range:
+            response.headers["Content-Range"] = content_range
+        if use_gzip and "gzip" in request.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=1)
+            response.headers["Content-Encoding"] = "gzip"
+        response.content_length = len(body)
+        await response.prepare(request)
+        for offset in range(0, len(body), SEND_CHUNK_SIZE):
+            chunk = body[offset:offset + SEND_CHUNK_SIZE]
+            await response.write(chunk)
+            if bandwidth:
+                await asyncio.sleep(len(chunk) / bandwidth)
+        await response.write_eof()
+        return response
+
+    async def stewardship(request):
+        await delay()
+        return web.json_response({"isRetrievable": request.match_info["reference"] in store})
+
+    async def chunk(request):
+        await delay()
+        reference = request.match_info["reference"]
+        if reference in chunks:
+            return web.Response(body=chunks[reference])
+        body = store.get(reference)
+        if body is None:
+            return web.Response(status=404, text="not found")
+        return web.Response(body=body[:4096])
+
+    app = web.Application(client_max_size=0)
+    app["store"] = store
+    app.router.add_post('/bzz', upload)
+    app.router.add_get('/bzz/{reference}', download)
+    app.router.add_get('/bytes/{reference}', download)
+    app.router.add_get('/ipfs/{reference}', download)
+    app.router.add_get('/stewardship/{reference}', stewardship)
+    app.router.add_get('/chunks/{reference}', chunk)
+    return app
+
+async def start_mock_gateway(host='127.0.0.1', port=0, **options):
+    """
+    Starts the mock gateway in the running event loop.
+
+    Args:
+        host (str): Address to listen on.
+        port (int): Port to listen on; 0 picks a free one.
+        **options: Passed on to `make_app`.
+
+    Returns:
+        tuple: (web.AppRunner, "host:port" the gateway listens on). Call `runner.cleanup()` to stop it.
+    """
+    runner = web.AppRunner(make_app(**options), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"{host}:{port}"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for a Bee node and an IPFS gateway.')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=1633, help='port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each answer')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra latency of up to this many seconds')
+    parser.add_argument('--bandwidth', type=float, help='download bandwidth in bytes per second (default: unlimited)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of downloads answered with HTTP 500')
+    parser.add_argument('--corrupt-rate', type=float, default=0.0, help='fraction of downloads with a corrupted body')
+    parser.add_argument('--gzip', action='store_true', help='gzip download bodies for clients that accept it')
+    parser.add_argument('--seed', type=int, help='seed for the error injection')
+    parser.add_argument('--swarm-addressing', action='store_true', help='address uploads with real Swarm references and manifests')
+    args = parser.parse_args()
+
+    logging.info(f"Mock gateway listening on {args.host}:{args.port}")
+    web.run_app(make_app(latency=args.latency, jitter=args.jitter, bandwidth=args.bandwidth, error_rate=args.error_rate,
+                         corrupt_rate=args.corrupt_rate, use_gzip=args.gzip, seed=args.seed,
+                         swarm_addressing=args.swarm_addressing),
+                 host=args.host, port=args.port, print=None, access_log=None)
@@ -1,53 +1,65 @@
 #!/bin/bash
 
 LOGFILE="logfile.log"
+WAIT="60m"
+
+# Every run of this script is a campaign of its own in campaign_state.jsonl. Its
+# id is kept in CAMPAIGN_FILE, so RESUME=1 continues the interrupted run instead
+# of seeing the cells of an earlier, finished one. Set CAMPAIGN to choose the id.
+CAMPAIGN_FILE=".runswarm500_campaign"
+if [ -z "$CAMPAIGN" ]; then
+  if [ -n "$RESUME" ] && [ -f "$CAMPAIGN_FILE" ]; then
+    CAMPAIGN=$(cat "$CAMPAIGN_FILE")
+  else
+    CAMPAIGN="runswarm500-$(date +%Y-%m-%d_%H-%M-%S)"
+  fi
+fi
+echo "$CAMPAIGN" > "$CAMPAIGN_FILE"
+
+# One cell of the design: upload, wait for the data to sync, download, and
+# archive the references. Run with RESUME=1 to skip the cells recorded as done
+# in campaign_state.jsonl and to continue an interrupted cell where it stopped.
+# Set PROBE_SERVER to a Bee node outside the download servers to start each
+# download as soon as that node finds the data retrievable, instead of sleeping.
+cell() {
+  local repeat=$1 size=$2 ul=$3 dl=$4
+  local cellargs="--size $size --ul-redundancy $ul --dl-redundancy $dl --only-swarm --campaign $CAMPAIGN"
+  local syncargs=""
+  if [ -n "$RESUME" ]; then
+    if python3 app.py --cell-done $cellargs; then
+      echo "cell size=$size ul=$ul dl=$dl already done, skipping"
+      return
+    fi
+    cellargs="$cellargs --resume"
+  fi
+  python3 app.py --upload --repeat $repeat $cellargs
+  if [ -n "$PROBE_SERVER" ]; then
+    syncargs="--sync-wait probe --probe-server $PROBE_SERVER"
+  else
+    sleep $WAIT
+  fi
+  python3 app.py --download --repeat 1 $cellargs $syncargs --archive-references references
+}
 
 {
   echo "Starting script execution at $(date)"
-  python3 app.py --upload --repeat 15 --size 500000 --ul-redundancy 0 --only-swarm
-  sleep 60m
-  python3 app.py --download --repeat 1 --dl-redundancy 0 --only-swarm
-  mv references_onlyswarm.json references/references_onlyswarm_0_0_$(date +%F_%H-%M).json
-
-  python3 app.py --upload --repeat 15 --size 500000 --ul-redundancy 1 --only-swarm
-  sleep 60m
-  python3 app.py --download --repeat 1 --dl-redundancy 1 --only-swarm
-  mv references_onlyswarm.json references/references_onlyswarm_1_1_$(date +%F_%H-%M).json
-
-  python3 app.py --upload --repeat 15 --size 500000 --ul-redundancy 1 --only-swarm
-  sleep 60m
-  python3 app.py --download --repeat 1 --dl-redundancy 3 --only-swarm
-  mv references_onlyswarm.json references/references_onlyswarm_1_3_$(date +%F_%H-%M).json
-
-  python3 app.py --upload --repeat 15 --size 500000 --ul-redundancy 2 --only-swarm
-  sleep 60m
-  python3 app.py --download --repeat 1 --dl-redundancy 1 --only-swarm
-  mv references_onlyswarm.json references/references_onlyswarm_2_1_$(date +%F_%H-%M).json
-
-  python3 app.py --upload --repeat 15 --size 500000 --ul-redundancy 2 --only-swarm
-  sleep 60m
-  python3 app.py --download --repeat 1 --dl-redundancy 3 --only-swarm
-  mv references_onlyswarm.json references/references_onlyswarm_2_3_$(date +%F_%H-%M).json
-
-  python3 app.py --upload --repeat 15 --size 500000 --ul-redundancy 3 --only-swarm
-  sleep 60m
-  python3 app.py --download --repeat 1 --dl-redundancy 1 --only-swarm
-  mv references_onlyswarm.json references/references_onlyswarm_3_1_$(date +%F_%H-%M).json
-
-  python3 app.py --upload --repeat 15 --size 500000 --ul-redundancy 3 --only-swarm
-  sleep 60m
-  python3 app.py --download --repeat 1 --dl-redundancy 3 --only-swarm
-  mv references_onlyswarm.json references/references_onlyswarm_3_3_$(date +%F_%H-%M).json
-
-  python3 app.py --upload --repeat 15 --size 500000 --ul-redundancy 4 --only-swarm
-  sleep 60m
-  python3 app.py --download --repeat 1 --dl-redundancy 1 --only-swarm
-  mv references_onlyswarm.json references/references_onlyswarm_4_1_$(date +%F_%H-%M).json
-
-  python3 app.py --upload --repeat 15 --size 500000 --ul-redundancy 4 --only-swarm
-  sleep 60m
-  python3 app.py --download --repeat 1 --dl-redundancy 3 --only-swarm
-  mv references_onlyswarm.json references/references_onlyswarm_4_3_$(date +%F_%H-%M).json
+  cell 15 500000 0 0
+
+  cell 15 500000 1 1
+
+  cell 15 500000 1 3
+
+  cell 15 500000 2 1
+
+  cell 15 500000 2 3
+
+  cell 15 500000 3 1
+
+  cell 15 500000 3 3
+
+  cell 15 500000 4 1
+
+  cell 15 500000 4 3
 
   echo "all runs completed $(date)"
 } 2>&1 | tee -a "$LOGFILE"
@@ -0,0 +1,359 @@
+"""Swarm content addressing, computed locally.
+
+Implements the chunker and binary Merkle tree (BMT) hash Bee uses to derive the
+reference of uploaded bytes, so a reference can be checked without downloading
+the data. Keccak256 runs on numpy arrays over many messages at once: all the
+segment pairs of one BMT level, across every chunk of a batch, are hashed in a
+single vectorized keccak-f[1600] pass.
+
+Only unencrypted data without erasure coding (redundancy level 0) is covered;
+with redundancy, Bee adds Reed-Solomon parity chunks to every intermediate chunk.
+"""
+import json
+
+import numpy as np
+from Crypto.Hash import keccak
+
+CHUNK_SIZE = 4096
+SEGMENT_SIZE = 32
+SPAN_SIZE = 8
+BRANCHES = CHUNK_SIZE // SEGMENT_SIZE
+HASH_BATCH = 16384  # messages per keccak pass, small enough to stay in cache
+
+_ROUND_CONSTANTS = np.array([
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008,
+], dtype=np.uint64)
+
+# Rotation offsets, indexed [x][y]
+_ROTATIONS = [
+    [0, 36, 3, 41, 18],
+    [1, 44, 10, 45, 2],
+    [62, 6, 43, 15, 61],
+    [28, 55, 25, 21, 56],
+    [27, 20, 39, 8, 14],
+]
+# rho and pi as (source lane, destination lane, rotation), lanes numbered x + 5y
+_RHO_PI = [(x + 5 * y, y + 5 * ((2 * x + 3 * y) % 5), _ROTATIONS[x][y]) for x in range(5) for y in range(5)]
+
+_RATE_LANES = 17  # 1088-bit rate of keccak256
+
+def _rotate(lane, shift):
+    if shift == 0:
+        return lane
+    return (lane << np.uint64(shift)) | (lane >> np.uint64(64 - shift))
+
+def _keccak_f(state):
+    """Applies keccak-f[1600] to a list of 25 lane arrays, one element per message."""
+    for round_constant in _ROUND_CONSTANTS:
+        # theta
+        columns = [state[x] ^ state[x + 5] ^ state[x + 10] ^ state[x + 15] ^ state[x + 20] for x in range(5)]
+        for x in range(5):
+            mix = _rotate(columns[(x + 1) % 5], 1)
+            mix ^= columns[(x - 1) % 5]
+            for y in range(0, 25, 5):
+                state[x + y] ^= mix
+        # rho and pi
+        moved = [None] * 25
+        for source, destination, shift in _RHO_PI:
+            moved[destination] = _rotate(state[source], shift)
+        # chi
+        for y in range(0, 25, 5):
+            for x in range(5):
+                lane = np.invert(moved[(x + 1) % 5 + y])
+                lane &= moved[(x + 2) % 5 + y]
+                lane ^= moved[x + y]
+                state[x + y] = lane
+        # iota
+        state[0] ^= round_constant
+
+def keccak256_batch(messages):
+    """
+    Hashes many messages of the same length with keccak256.
+
+    Args:
+        messages (np.ndarray): (N, L) uint8 array, one message per row. L must be a
+            multiple of 8 and shorter than 136 bytes, so every message is one block.
+
+    Returns:
+        np.ndarray: (N, 32) uint8 array of digests.
+    """
+    count, length = messages.shape
+    if length % 8 or length >= _RATE_LANES * 8:
+        raise ValueError(f"Messages of {length} bytes are not supported")
+    digests = np.empty((count, 32), dtype=np.uint8)
+    for start in range(0, count, HASH_BATCH):
+        block = np.ascontiguousarray(messages[start:start + HASH_BATCH])
+        lanes = block.view('<u8')
+        state = [np.zeros(len(block), dtype=np.uint64) for _ in range(25)]
+        for i in range(length // 8):
+            state[i] = lanes[:, i].copy()
+        # keccak padding: 0x01 after the message, 0x80 at the end of the rate
+        state[length // 8] ^= np.uint64(0x01)
+        state[_RATE_LANES - 1] ^= np.uint64(0x8000000000000000)
+        _keccak_f(state)
+        out = np.stack(state[:4], axis=1).astype('<u8')
+        digests[start:start + len(block)] = out.view(np.uint8).reshape(len(block), 32)
+    return digests
+
+def bmt_roots(payloads):
+    """
+    Computes the BMT root of each chunk payload.
+
+    Args:
+        payloads (np.ndarray): (N, 4096) uint8 array of zero-padded chunk payloads.
+
+    Returns:
+        np.ndarray: (N, 32) uint8 array of BMT roots.
+    """
+    count = len(payloads)
+    nodes = payloads.reshape(count * BRANCHES // 2, 2 * SEGMENT_SIZE)
+    width = BRANCHES // 2
+    while True:
+        nodes = keccak256_batch(nodes)
+        if width == 1:
+            return nodes
+        width //= 2
+        nodes = nodes.reshape(count * width, 2 * SEGMENT_SIZE)
+
+def encode_span(span):
+    """Returns the 8-byte little-endian span of a chunk."""
+    return int(span).to_bytes(SPAN_SIZE, 'little')
+
+def chunk_addresses(spans, payloads):
+    """
+    Computes the addresses of content-addressed chunks, keccak256(span || BMT root).
+
+    Args:
+        spans (list): The span of every chunk, i.e. the number of data bytes it covers.
+        payloads (np.ndarray): (N, 4096) uint8 array of zero-padded chunk payloads.
+
+    Returns:
+        np.ndarray: (N, 32) uint8 array of chunk addresses.
+    """
+    messages = np.empty((len(payloads), SPAN_SIZE + SEGMENT_SIZE), dtype=np.uint8)
+    messages[:, :SPAN_SIZE] = np.array(spans, dtype='<u8').view(np.uint8).reshape(-1, SPAN_SIZE)
+    messages[:, SPAN_SIZE:] = bmt_roots(payloads)
+    return keccak256_batch(messages)
+
+def chunk_address(data):
+    """Returns the address of one chunk given as span followed by payload, as Bee's /chunks serves it."""
+    payload = np.zeros((1, CHUNK_SIZE), dtype=np.uint8)
+    body = np.frombuffer(data[SPAN_SIZE:], dtype=np.uint8)
+    payload[0, :len(body)] = body
+    return bytes(chunk_addresses([int.from_bytes(data[:SPAN_SIZE], 'little')], payload)[0])
+
+def chunk_addresses_of(chunks, batch_chunks=256):
+    """Returns the addresses of chunks given as span followed by payload, hashed in batches."""
+    addresses = []
+    for start in range(0, len(chunks), batch_chunks):
+        batch = chunks[start:start + batch_chunks]
+        payloads = np.zeros((len(batch), CHUNK_SIZE), dtype=np.uint8)
+        for row, data in enumerate(batch):
+            body = np.frombuffer(data[SPAN_SIZE:], dtype=np.uint8)
+            payloads[row, :len(body)] = body
+        spans = [int.from_bytes(data[:SPAN_SIZE], 'little') for data in batch]
+        addresses.extend(bytes(address) for address in chunk_addresses(spans, payloads))
+    return addresses
+
+class SwarmChunker:
+    """Computes the Swarm reference of a byte stream, the way `hashlib` objects compute digests.
+
+    Data chunks are hashed in batches as the stream arrives; only their addresses
+    and spans are kept, so memory stays at 40 bytes per 4 KB of input. If a
+    `store` dict is given, every chunk of the tree is also put there, as span
+    followed by payload under its hex address.
+    """
+
+    def __init__(self, batch_chunks=256, store=None):
+        self.batch_chunks = batch_chunks
+        self.store = store
+        self.buffer = bytearray()
+        self.addresses = []
+        self.spans = []
+
+    def update(self, data):
+        self.buffer += data
+        full = len(self.buffer) // CHUNK_SIZE
+        if full >= self.batch_chunks:
+            self._hash_leaves(full)
+
+    def _hash_leaves(self, count, last_length=CHUNK_SIZE):
+        length = (count - 1) * CHUNK_SIZE + last_length
+        payloads = np.zeros((count, CHUNK_SIZE), dtype=np.uint8)
+        payloads.reshape(-1)[:length] = np.frombuffer(bytes(self.buffer[:length]), dtype=np.uint8)
+        spans = [CHUNK_SIZE] * (count - 1) + [last_length]
+        self._add_chunks(spans, payloads, spans, self.addresses)
+        self.spans.extend(spans)
+        del self.buffer[:length]
+
+    def _add_chunks(self, spans, payloads, lengths, addresses):
+        hashed = chunk_addresses(spans, payloads)
+        addresses.extend(hashed)
+        if self.store is not None:
+            for address, span, payload, length in zip(hashed, spans, payloads, lengths):
+                self.store[bytes(address).hex()] = encode_span(span) + payload[:length].tobytes()
+
+    def digest(self):
+        """Returns the 32-byte reference of the stream; call it once, after the last `update`."""
+        full, rest = divmod(len(self.buffer), CHUNK_SIZE)
+        if full:
+            self._hash_leaves(full)
+        if rest or not self.spans:
+            self._hash_leaves(1, rest)
+
+        addresses, spans = self.addresses, self.spans
+        while len(addresses) > 1:
+            parents, parent_spans, wrap_spans, payloads, lengths = [], [], [], [], []
+            for start in range(0, len(addresses), BRANCHES):
+                group = addresses[start:start + BRANCHES]
+                if len(group) == 1:
+                    # A lone reference is carried up to the next level instead of being wrapped
+                    parents.append(group[0])
+                    parent_spans.append(spans[start])
+                    continue
+                payload = np.zeros(CHUNK_SIZE, dtype=np.uint8)
+                payload[:len(group) * SEGMENT_SIZE] = np.concatenate(group)
+                payloads.append(payload)
+                lengths.append(len(group) * SEGMENT_SIZE)
+                wrap_spans.append(sum(spans[start:start + BRANCHES]))
+                parents.append(None)
+                parent_spans.append(wrap_spans[-1])
+            wrapped = []
+            self._add_chunks(wrap_spans, np.stack(payloads), lengths, wrapped)
+            wrapped = iter(wrapped)
+            addresses = [parent if parent is not None else next(wrapped) for parent in parents]
+            spans = parent_spans
+        return bytes(addresses[0])
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+def swarm_reference(chunks, store=None):
+    """Returns the hex Swarm reference of the bytes yielded by `chunks`, e.g. `random_payload`."""
+    chunker = SwarmChunker(store=store)
+    for chunk in chunks:
+        chunker.update(chunk)
+    return chunker.hexdigest()
+
+# Data children an intermediate chunk holds per erasure coding level; the rest of its references are parity
+MAX_DATA_SHARDS = {0: BRANCHES, 1: 119, 2: 107, 3: 97, 4: 38}
+
+def decode_span(chunk):
+    """
+    Reads the span of a chunk given as span followed by payload.
+
+    With erasure coding, Bee marks the redundancy level in the top byte of the
+    span of intermediate chunks; it is masked off here.
+
+    Returns:
+        tuple: (span, redundancy level).
+    """
+    span = bytearray(chunk[:SPAN_SIZE])
+    level = 0
+    if span[-1] & 0x80:
+        level = span[-1] & 0x7f
+        span[-1] = 0
+    return int.from_bytes(span, 'little'), level
+
+def data_children(chunk):
+    """
+    Lists the data children of an intermediate chunk, leaving out parity chunks.
+
+    Args:
+        chunk (bytes): Span followed by payload.
+
+    Returns:
+        list: (hex reference, span) of each data child; empty for a leaf chunk.
+    """
+    span, level = decode_span(chunk)
+    if span <= CHUNK_SIZE:
+        return []
+    branching = MAX_DATA_SHARDS[level]
+    child_span = CHUNK_SIZE
+    while child_span * branching < span:
+        child_span *= branching
+    count = -(-span // child_span)
+    payload = chunk[SPAN_SIZE:]
+    return [(payload[i * SEGMENT_SIZE:(i + 1) * SEGMENT_SIZE].hex(), min(child_span, span - i * child_span)) for i in range(count)]
+
+MANTARAY_VERSION_HASH = keccak.new(digest_bits=256, data=b"mantaray:0.2").digest()[:31]
+NODE_TYPE_VALUE = 2
+NODE_TYPE_EDGE = 4
+NODE_TYPE_WITH_PATH_SEPARATOR = 8
+NODE_TYPE_WITH_METADATA = 16
+FORK_PREFIX_SIZE = 30
+
+def marshal_manifest_node(entry=None, forks=None):
+    """
+    Serializes a mantaray 0.2 manifest node without obfuscation, the inverse of `parse_manifest_node`.
+
+    Args:
+        entry (str, optional): Hex reference the node points to.
+        forks (dict, optional): {prefix bytes: {"type": node type of the child,
+            "reference": hex reference of the child node, "metadata": dict or None}}.
+
+    Returns:
+        bytes: The node, to be stored as the payload of a chunk.
+    """
+    data = bytes(32) + MANTARAY_VERSION_HASH + bytes([SEGMENT_SIZE])
+    data += bytes.fromhex(entry) if entry else bytes(SEGMENT_SIZE)
+    forks = forks or {}
+    index = bytearray(32)
+    for prefix in forks:
+        index[prefix[0] // 8] |= 1 << (prefix[0] % 8)
+    data += bytes(index)
+    for prefix in sorted(forks, key=lambda p: p[0]):
+        fork = forks[prefix]
+        data += bytes([fork["type"], len(prefix)]) + prefix.ljust(FORK_PREFIX_SIZE, b'\0') + bytes.fromhex(fork["reference"])
+        if fork["type"] & NODE_TYPE_WITH_METADATA:
+            metadata = json.dumps(fork["metadata"], separators=(',', ':')).encode()
+            metadata += b'\n' * (-(len(metadata) + 2) % SEGMENT_SIZE)
+            data += len(metadata).to_bytes(2, 'big') + metadata
+    return data
+
+def parse_manifest_node(data):
+    """
+    Parses one mantaray manifest node (version 0.2), as stored in a chunk payload.
+
+    Args:
+        data (bytes): The chunk payload, without the span.
+
+    Returns:
+        dict: {"entry": hex reference or None, "forks": {first byte: {"prefix": bytes,
+        "reference": hex, "metadata": dict}}}.
+
+    Raises:
+        ValueError: If the data is not a mantaray 0.2 node.
+    """
+    key = data[:32]
+    if any(key):
+        data = key + bytes(b ^ key[i % 32] for i, b in enumerate(data[32:]))
+    if data[32:63] != MANTARAY_VERSION_HASH:
+        raise ValueError("Not a mantaray 0.2 manifest node")
+    ref_size = data[63]
+    entry = data[64:64 + ref_size]
+    offset = 64 + ref_size
+    index = data[offset:offset + 32]
+    offset += 32
+
+    forks = {}
+    for byte in range(256):
+        if not index[byte // 8] & (1 << (byte % 8)):
+            continue
+        node_type, prefix_length = data[offset], data[offset + 1]
+        prefix = data[offset + 2:offset + 2 + prefix_length]
+        offset += 2 + FORK_PREFIX_SIZE
+        reference = data[offset:offset + ref_size]
+        offset += ref_size
+        metadata = {}
+        if node_type & NODE_TYPE_WITH_METADATA:
+            metadata_size = int.from_bytes(data[offset:offset + 2], 'big')
+            metadata = json.loads(data[offset + 2:offset + 2 + metadata_size].decode().strip() or '{}')
+            offset += 2 + metadata_size
+        forks[byte] = {"prefix": prefix, "reference": reference.hex(), "metadata": metadata}
+    return {"entry": entry.hex() if any(entry) else None, "forks": forks}